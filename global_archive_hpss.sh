@@ -14,13 +14,25 @@ echo "Rundate: $RUNDATE"
 WORKDIR=/scratch2/NCEPDEV/stmp1/Deanna.Spindler/cdo/$RUNDATE
 ARCHDIR=/scratch2/NCEPDEV/ocean/Deanna.Spindler/noscrub/Global/archive
 SRCDIR=/scratch2/NCEPDEV/ocean/Deanna.Spindler/save/VPPPG/Global_RTOFS/EMC_ocean-prod-gen/dataproc/scripts
+GODAEDIR=/scratch2/NCEPDEV/ocean/Deanna.Spindler/save/VPPPG/Global_RTOFS/EMC_ocean-verification/godae
 
 mkdir -p $ARCHDIR
 
 $SRCDIR/hpss_extractor.sh $RUNDATE
+status=$?
+if (( status != 0 )); then
+  # finished files stay in $WORKDIR, a rerun only redoes the others
+  echo "hpss extraction failed for $RUNDATE, nothing archived"
+  exit $status
+fi
 
 # move datasets to archive
 cp -r $WORKDIR $ARCHDIR/.
 rm -rf $WORKDIR
 
+# mirror the day into zarr stores for the GODAE reads, the NetCDF files stay
+module use /scratch2/NCEPDEV/ocean/Deanna.Spindler/save/modulefiles
+module load anaconda-xesmf/1.0.0
+python $GODAEDIR/ush/rtofs_zarr.py $RUNDATE
+
 exit
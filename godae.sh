@@ -26,6 +26,13 @@ echo "Starting GODAE for $THE_DATE to $STOP_DATE"
 
 TASK_QUEUE='batch'
 WALL='0:30:00'
+# the four params used to run as four 4-task jobs of $WALL each, the one
+# job that runs them now gets their 16 tasks and the sum of their limits
+JOB_WALL='2:00:00'
+# a backfill job gets BACKFILL_MINUTES per date, a longer range is split
+# into jobs of BACKFILL_DAYS dates so none passes the 8 hour batch limit
+BACKFILL_MINUTES=30
+BACKFILL_DAYS=16
 #PROJ='marine-cpu'
 PROJ='ovp'
 LOGPATH=/scratch2/NCEPDEV/stmp1/Deanna.Spindler/logs/godae
@@ -35,8 +42,8 @@ JOB="godae"
 mkdir -p $LOGPATH
 #rm -f $LOGPATH/*.log
 
-# clean out the weights from any previous run before we begin
-rm -f $PROFILEPATH/godae/*.nc
+# $PROFILEPATH/godae keeps the RTOFS grid index and the HYCOM MDT cache
+# between runs, both are rebuilt by the job when their inputs change
 
 #cp -r $HOME/.ipython/profile_xesmf $PROFILEPATH/profile_default
 #export IPYTHONDIR=${PROFILEPATH}
@@ -45,16 +52,36 @@ SRCDIR='/scratch2/NCEPDEV/ocean/Deanna.Spindler/save/VPPPG/Global_RTOFS/EMC_ocea
 
 NEWHOME='/scratch2/NCEPDEV/ocean/Deanna.Spindler/save'
 
-while (( $THE_DATE <= $STOP_DATE )); do
+# the jobs first mirror their RTOFS run days, valid date -8 to +1, into
+# the zarr stores.  Leads already mirrored are skipped, a failed mirror
+# only means the reads come from the NetCDF files.
+
+if [[ $THE_DATE == $STOP_DATE ]]; then
+  MIRROR="python $SRCDIR/ush/rtofs_zarr.py $(date --date="${THE_DATE} -8days" +%Y%m%d) $(date --date="${THE_DATE} +1day" +%Y%m%d)"
   # get the data
   /scratch2/NCEPDEV/ocean/Deanna.Spindler/save/bin/get_godae.sh $THE_DATE
   echo "Submitting job for $THE_DATE"
-  job1=$(sbatch --parsable -J ${JOB}_1_${THE_DATE} -o $LOGPATH/${JOB}_1_${THE_DATE}.log -q $TASK_QUEUE --account=$PROJ --time $WALL --ntasks=4 --nodes=1 --wrap "python $SRCDIR/ush/godae_rtofsv2.py $THE_DATE profile")
-  job2=$(sbatch --parsable -J ${JOB}_2_${THE_DATE} -o $LOGPATH/${JOB}_2_${THE_DATE}.log -q $TASK_QUEUE --account=$PROJ --time $WALL --ntasks=4 --nodes=1 --wrap "python $SRCDIR/ush/godae_rtofsv2.py $THE_DATE SLA")
-  job3=$(sbatch --parsable -J ${JOB}_3_${THE_DATE} -o $LOGPATH/${JOB}_3_${THE_DATE}.log -q $TASK_QUEUE --account=$PROJ --time $WALL --ntasks=4 --nodes=1 --wrap "python $SRCDIR/ush/godae_rtofsv2.py $THE_DATE SST")
-  job4=$(sbatch --parsable -J ${JOB}_4_${THE_DATE} -o $LOGPATH/${JOB}_4_${THE_DATE}.log -q $TASK_QUEUE --account=$PROJ --time $WALL --ntasks=4 --nodes=1 --wrap "python $SRCDIR/ush/godae_rtofsv2.py $THE_DATE aice")
-  # this last one uploads to GODAE, needs to run after testing jobs 1-4 work.
-  job5=$(sbatch --parsable --dependency=afterok:${job1}:${job2}:${job3}:${job4} --partition=service -J ${JOB}_transfer_${THE_DATE} -q $TASK_QUEUE --account=$PROJ --time $WALL --ntasks 1 -o $LOGPATH/transfer_${THE_DATE}.log --wrap "$SRCDIR/scripts/upload_godae.sh $THE_DATE")
-  THE_DATE=$(date --date="${THE_DATE} +1day" +%Y%m%d)  
-done
-
+  # all four params in one process, the 4 tasks each param had in its own job
+  job1=$(sbatch --parsable -J ${JOB}_${THE_DATE} -o $LOGPATH/${JOB}_${THE_DATE}.log -q $TASK_QUEUE --account=$PROJ --time $JOB_WALL --ntasks=16 --nodes=1 --wrap "$MIRROR; python $SRCDIR/ush/godae_rtofsv2.py $THE_DATE profile SLA SST aice --workers 4")
+  # this last one uploads to GODAE, needs to run after testing job 1 works.
+  job5=$(sbatch --parsable --dependency=afterok:${job1} --partition=service -J ${JOB}_transfer_${THE_DATE} -q $TASK_QUEUE --account=$PROJ --time $WALL --ntasks 1 -o $LOGPATH/transfer_${THE_DATE}.log --wrap "$SRCDIR/scripts/upload_godae.sh $THE_DATE")
+else
+  # backfill: one job walks each block of dates for all params, so the
+  # RTOFS files shared by consecutive dates are only read once
+  /scratch2/NCEPDEV/ocean/Deanna.Spindler/save/bin/get_godae.sh $THE_DATE $STOP_DATE
+  while (( $THE_DATE <= $STOP_DATE )); do
+    BLOCK_STOP=$(date --date="${THE_DATE} +$((BACKFILL_DAYS-1))days" +%Y%m%d)
+    if (( $BLOCK_STOP > $STOP_DATE )); then
+      BLOCK_STOP=$STOP_DATE
+    fi
+    DAYS=$(( ($(date --date=$BLOCK_STOP +%s)-$(date --date=$THE_DATE +%s))/86400+1 ))
+    BACKFILL_WALL=$(( DAYS*BACKFILL_MINUTES ))
+    MIRROR="python $SRCDIR/ush/rtofs_zarr.py $(date --date="${THE_DATE} -8days" +%Y%m%d) $(date --date="${BLOCK_STOP} +1day" +%Y%m%d)"
+    RANGE=${THE_DATE}_${BLOCK_STOP}
+    echo "Submitting backfill job for $RANGE, $BACKFILL_WALL minutes"
+    job1=$(sbatch --parsable -J ${JOB}_${RANGE} -o $LOGPATH/${JOB}_${RANGE}.log -q $TASK_QUEUE --account=$PROJ --time $BACKFILL_WALL --ntasks=4 --nodes=1 --wrap "$MIRROR; python $SRCDIR/ush/godae_rtofsv2.py profile SLA SST aice --start $THE_DATE --stop $BLOCK_STOP --workers 4")
+    # upload whatever was produced once it is done
+    job5=$(sbatch --parsable --dependency=afterany:${job1} --partition=service -J ${JOB}_transfer_${RANGE} -q $TASK_QUEUE --account=$PROJ --time $WALL --ntasks 1 -o $LOGPATH/transfer_${RANGE}.log --wrap "$SRCDIR/scripts/upload_godae.sh $THE_DATE $BLOCK_STOP")
+    THE_DATE=$(date --date="${BLOCK_STOP} +1day" +%Y%m%d)
+  done
+fi
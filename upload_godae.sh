@@ -3,29 +3,24 @@
 # Transfer GODAE data sets to USGODAE from front end node hfe01
 #
 
-NEWHOME='/scratch2/NCEPDEV/ocean/Deanna.Spindler'
-GODAEHOME='/scratch2/NCEPDEV/ocean/Deanna.Spindler/noscrub/GODAE/outgoing'
-VERSION='2.0'
+SRCDIR='/scratch2/NCEPDEV/ocean/Deanna.Spindler/save/VPPPG/Global_RTOFS/EMC_ocean-verification/godae'
+MODULES='module use /scratch2/NCEPDEV/ocean/Deanna.Spindler/save/modulefiles; module load anaconda-work/1.0.0'
 
 theDate=${1:-$(date --date='-6 days' +%Y%m%d)}
 stopDate=${2:-$theDate}  
 
-echo "uploading from $theDate to $stopDate"
+echo "uploading from $theDate to $stopDate at `date`"
 
-while (( $theDate <= $stopDate )); do
-  for filetype in profile aice SST SLA; do
-    if [[ -a $GODAEHOME/class4_${theDate}_HYCOM_RTOFS_${VERSION}_${filetype}.nc.gz.enc ]]; then
-      echo "Beginning upload of $filetype at `date`"
-	  if [[ $HOSTNAME == 'hfe01' ]]; then
-        /usr/bin/curl -T $GODAEHOME/class4_${theDate}_HYCOM_RTOFS_${VERSION}_${filetype}.nc.gz.enc ftp://ftp.usgodae.org/pub/incoming/class4/
-	  else
-	    ssh hfe01 /usr/bin/curl -T $GODAEHOME/class4_${theDate}_HYCOM_RTOFS_${VERSION}_${filetype}.nc.gz.enc ftp://ftp.usgodae.org/pub/incoming/class4/
-		#curl -v -T $POLARHOME/class4_${theDate}_HYCOM_RTOFS_${VERSION}_${filetype}.nc.gz.enc ftp://usgodae.org/pub/incoming/class4/
-	  fi
-      echo "Finished at `date`"
-    fi
-  done
-  theDate=$(date --date="$theDate +1day" "+%Y%m%d")
-done
-  
-exit              
+# every product of the date range in one pool of concurrent, resumed and
+# size checked FTP uploads to ftp.usgodae.org/pub/incoming/class4
+UPLOAD="python $SRCDIR/ush/godae_transfer.py put $theDate $stopDate --workers 4"
+if [[ $HOSTNAME == 'hfe01' ]]; then
+  eval "$MODULES"
+  $UPLOAD
+else
+  ssh hfe01 "bash -lc '$MODULES; $UPLOAD'"
+fi
+status=$?
+
+echo "Finished at `date`"
+exit $status
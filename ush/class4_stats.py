@@ -0,0 +1,146 @@
+#!/bin/env python
+"""
+Merge the class-4 statistics of the GODAE products into summaries
+
+Notes
+    godae_rtofsv2.py keeps running sums of every product it makes (count,
+    sum and sum of squares of model minus obs, ..., see class4_stats) in
+        {godaeDir}/stats/YYYY/class4_YYYYMMDD_HYCOM_RTOFS_2.0_{param}.stats.nc
+    by obs type, source, region, lead, variable and depth bin.  Sums add
+    up, so a month or a year is the sum of its days without opening the
+    products again, and merged files can be merged again.
+
+    For each period the merged sums are written to
+        {outDir}/class4_{period}_HYCOM_RTOFS_2.0.stats.nc
+    and the metrics to .metrics.nc next to it:
+        count, bias, rmse, mae, std_error (bias removed), correlation
+    Global forecast and persistence scores by lead are printed.
+
+Usage
+    python class4_stats.py 20230101 20230131
+    python class4_stats.py 20230101 20231231 --by month --params profile SST
+"""
+import warnings
+warnings.filterwarnings("ignore")
+import pandas as pd
+import xarray as xr
+import numpy as np
+from datetime import datetime
+import argparse
+import os, sys
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+import godae_rtofsv2 as godae
+
+periods={'day':'%Y%m%d','month':'%Y%m','year':'%Y'}
+
+#----------------------------------------------------------------
+def merge_stats(stats):
+    """
+    Add up class-4 aggregates, leads, depth bins, variables and obs types
+    missing from one of them count as zero
+    """
+    total=None
+    for ds in stats:
+        if total is None:
+            total=ds
+            continue
+        attrs=total.attrs
+        total,ds=xr.align(total,ds,join='outer',fill_value=0)
+        start=min(attrs['start_date'],ds.attrs['start_date'])
+        end=max(attrs['end_date'],ds.attrs['end_date'])
+        total=total+ds
+        total.attrs=dict(attrs,start_date=start,end_date=end)
+    return total
+#----------------------------------------------------------------
+def load_stats(files):
+    """
+    read and merge the aggregates in files, None if there are none.  The
+    file encodings are dropped, string lengths change in the merge.
+    """
+    stats=[]
+    for fname in files:
+        with xr.open_dataset(fname) as ds:
+            ds=ds.load()
+        for var in ds.variables.values():
+            var.encoding={}
+        stats.append(ds)
+    return merge_stats(stats)
+#----------------------------------------------------------------
+def class4_metrics(stats):
+    """
+    scores from the running sums, NaN where there are no obs
+    """
+    n=stats['count'].where(stats['count']>0)
+    metrics=xr.Dataset({'count':stats['count']})
+    metrics['bias']=stats.sum_error/n
+    metrics['rmse']=np.sqrt(stats.sumsq_error/n)
+    metrics['mae']=stats.sum_abs_error/n
+    metrics['std_error']=np.sqrt(np.maximum(metrics.rmse**2-metrics.bias**2,0))
+    var_obs=n*stats.sumsq_obs-stats.sum_obs**2
+    var_model=n*stats.sumsq_model-stats.sum_model**2
+    metrics['correlation']=(n*stats.sum_obs_model-stats.sum_obs*stats.sum_model)/np.sqrt(var_obs*var_model)
+    metrics.attrs=stats.attrs
+    return metrics
+#----------------------------------------------------------------
+def print_summary(stats):
+    """
+    global forecast and persistence scores by lead, all depths together
+    """
+    metrics=class4_metrics(stats.sel(region='global').sum('depth_bin'))
+    print(f"class-4 statistics {stats.attrs['start_date']} to {stats.attrs['end_date']}")
+    for obs_type in metrics.obs_type.values:
+        for variable in metrics.variable.values:
+            for source in ['forecast','persistence','best_estimate']:
+                m=metrics.sel(obs_type=obs_type,variable=variable,source=source)
+                for lead in m.lead.values:
+                    ml=m.sel(lead=lead)
+                    if ml['count']>0:
+                        print(f'{obs_type:>30} {variable:>12} {source:>13} {lead:5.0f}h',
+                              f"n={int(ml['count']):8d} bias={float(ml.bias):9.4f} rmse={float(ml.rmse):9.4f}")
+#----------------------------------------------------------------
+def summarize(start,stop,params,by='all',outDir=None):
+    """
+    Merge the daily statistics from start to stop by period and write the
+    sums and metrics of each.  Returns the files written.
+    """
+    outDir=outDir or f'{godae.godaeDir}/stats'
+    os.makedirs(outDir,exist_ok=True)
+    dates=pd.date_range(start,stop)
+    if by=='all':
+        groups={f'{start:%Y%m%d}_{stop:%Y%m%d}':dates}
+    else:
+        groups={key:list(group) for key,group in pd.Series(dates,index=dates).groupby(dates.strftime(periods[by]))}
+    written=[]
+    for period,days in groups.items():
+        files=[godae.stats_file(theDate,param) for theDate in days for param in params]
+        files=[fname for fname in files if os.path.exists(fname)]
+        if not files:
+            print('No statistics for',period)
+            continue
+        stats=load_stats(files)
+        fname=f'{outDir}/class4_{period}_HYCOM_RTOFS_{godae.product_version}.stats.nc'
+        stats.to_netcdf(fname,encoding={key:{'zlib':True} for key in stats.data_vars})
+        class4_metrics(stats).to_netcdf(fname.replace('.stats.nc','.metrics.nc'))
+        print_summary(stats)
+        print('wrote',fname,f'from {len(files)} products')
+        written.append(fname)
+    return written
+#----------------------------------------------------------------
+
+# main routine starts here
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge GODAE class-4 statistics by period')
+    parser.add_argument('start',type=str,help='first date YYYYMMDD')
+    parser.add_argument('stop',type=str,help='last date YYYYMMDD')
+    parser.add_argument('--params',nargs='+',default=['profile','SST','SLA','aice'],
+                        choices=['profile','SST','SLA','aice'])
+    parser.add_argument('--by',choices=['all','day','month','year'],default='all',
+                        help='one summary for the whole range or one per period')
+    parser.add_argument('--output-dir',type=str,default=None,help='default: GODAE/stats')
+    args = parser.parse_args()
+
+    start=datetime.strptime(args.start,'%Y%m%d')
+    stop=datetime.strptime(args.stop,'%Y%m%d')
+    summarize(start,stop,args.params,args.by,args.output_dir)
@@ -0,0 +1,293 @@
+#!/bin/env python
+"""
+Benchmark for the GODAE class-4 processing in godae_rtofsv2.py
+
+Notes
+    Runs offline against synthetic data written to a work directory:
+        RTOFS 3dz/2ds daily files on a tripolar grid with the HYCOM fold
+        FOAM (profile, SST, SLA) and GIOPS (aice) class4 files,
+            gzipped and encrypted as they are downloaded
+        12 HYCOM monthly mean SSH files on a regular grid
+    Grid size, levels, obs count and obs depths are set on the command line.
+
+    Each stage of one date is timed separately for every param:
+        get_godae, grid_index, stencil, get_rtofs_mean,
+        hycom_mdt_cache, get_hycom_climo (SLA), depth_interp (profile),
+        create_dataset, write_product, class4_stats
+    grid_index and hycom_mdt_cache rebuild their on-disk caches, the
+    other stages use them.  RTOFS reads start with an empty read cache.
+
+    Results are written as JSON, seconds for every repeat of each stage.
+
+Usage
+    python godae_benchmark.py --nobs 20000 --repeat 3 --output bench.json
+"""
+import warnings
+warnings.filterwarnings("ignore")
+import pandas as pd
+import xarray as xr
+import numpy as np
+from datetime import datetime, timedelta
+import argparse
+import tempfile
+import platform
+import shutil
+import json
+import time
+import os, sys
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+import godae_rtofsv2 as godae
+
+# param -> obs_type, numvars, class4 file name
+class4_files={'profile':('profile',2,'class4_{:%Y%m%d}_FOAM_orca025_14.1_profile.nc'),
+              'SST':('SST',1,'class4_{:%Y%m%d}_FOAM_orca025_14.1_SST.nc'),
+              'SLA':('SLA',1,'class4_{:%Y%m%d}_FOAM_orca025_14.1_SLA.nc'),
+              'aice':('AMSR2 brightness temperature',1,'class4_{:%Y%m%d}_GIOPS_CONCEPTS_3.3_aice.nc')}
+
+#----------------------------------------------------------------
+def set_dirs(root):
+    """
+    point godae_rtofsv2 at the synthetic data
+    """
+    godae.godaeDir=f'{root}/GODAE'
+    godae.modelDir=f'{root}/archive'
+    godae.tempDir=f'{root}/tmp'
+    godae.climoDir=f'{root}/climo'
+    for path in [f'{godae.godaeDir}/incoming',f'{godae.godaeDir}/outgoing',
+                 godae.modelDir,f'{godae.tempDir}/godae',godae.climoDir]:
+        os.makedirs(path,exist_ok=True)
+#----------------------------------------------------------------
+def make_grid(ny,nx,join=47.):
+    """
+    RTOFS-like tripolar lon/lat starting at 74.16E: regular south of join,
+    north of it a bipolar cap with its two poles on the join latitude at
+    the ends of the fold.  The cap is built in polar stereographic bipolar
+    coordinates, meridians are circles around the poles and rows are arcs
+    from pole to pole.  Row ny-2 ends half a row short of the fold and the
+    last row is its copy mirrored across the fold, X -> nx-1-X, as in HYCOM.
+    """
+    dlon=360./nx
+    pole=74.16-dlon/2  # no grid point on the poles
+    theta=np.deg2rad((np.arange(nx)+0.5)*dlon)
+    dlat=(90.+78.64)/(ny-1.5)
+    lat1=-78.64+np.arange(ny)*dlat  # 90 is the fold
+    lon,lat=np.meshgrid(pole+np.rad2deg(theta),lat1)
+    # the cap, the join circle has radius a in the stereographic plane
+    cap=lat1>join
+    a=2.*np.tan(np.deg2rad(90.-join)/2)
+    x,y=a*np.cos(theta),a*np.sin(theta)
+    tau=np.log(np.hypot(x+a,y)/np.hypot(x-a,y))
+    f=(lat1[cap]-join)/(90.-join)
+    sigma=np.sign(y)*np.pi/2*(1+f[:,np.newaxis])  # +-pi on the fold
+    x=a*np.sinh(tau)/(np.cosh(tau)-np.cos(sigma))
+    y=a*np.sin(sigma)/(np.cosh(tau)-np.cos(sigma))
+    lon[cap]=(pole+np.rad2deg(np.arctan2(y,x)))%360.
+    lat[cap]=90.-2.*np.rad2deg(np.arctan(np.hypot(x,y)/2.))
+    return lon.astype(np.float32),lat.astype(np.float32)
+#----------------------------------------------------------------
+def write_rtofs(vDate,params,ny,nx,nz):
+    """
+    All the RTOFS files the params need for vDate: run dates vDate-8 to
+    vDate+1, nowcast and forecasts out to 192 hours
+    """
+    lon,lat=make_grid(ny,nx)
+    depth=np.linspace(0.,5000.,nz)**1.5/5000.**0.5
+    land=(np.abs(lat-10.)<4.)&(np.abs(lon-200.)<20.)
+    bottom=np.where(np.cos(np.deg2rad(lat))>0.5,nz,nz//2)  # shallower at high latitudes
+    ftypes=sorted({f for param in params for f in godae.rtofs_ftypes[class4_files[param][0]]})
+    for runDate in pd.date_range(vDate-timedelta(8),vDate+timedelta(1)):
+        os.makedirs(f'{godae.modelDir}/{runDate:%Y%m%d}',exist_ok=True)
+        for ftype,fcst_hrs in [('n',24)]+[('f',h) for h in godae.rtofs_fcsts[1:]]:
+            valid=runDate+timedelta(hours=int(fcst_hrs)-24*(ftype=='n'))
+            coords={'Longitude':(('Y','X'),lon),'Latitude':(('Y','X'),lat),'MT':[valid]}
+            shift=runDate.dayofyear*0.01+fcst_hrs/1000.
+            surface=20.*np.cos(np.deg2rad(lat))+np.sin(np.deg2rad(lon))+shift
+            surface[land]=np.nan
+            for filetype in ftypes:
+                fname=godae.rtofs_file(runDate,ftype,fcst_hrs,filetype)
+                if filetype in ('daily_3ztio','daily_3zsio'):
+                    field=surface[np.newaxis]-depth[:,np.newaxis,np.newaxis]/250.
+                    field[np.arange(nz)[:,np.newaxis,np.newaxis]>=bottom]=np.nan
+                    if filetype=='daily_3zsio':
+                        field=34.+field/20.
+                    data=(('MT','Depth','Y','X'),field[np.newaxis].astype(np.float32))
+                    ds=xr.Dataset({godae.rtofs_vars[filetype][0]:data},coords={**coords,'Depth':depth})
+                else:
+                    field={'prog':surface,'diag':surface/20.-0.5,
+                           'ice':np.clip((np.abs(lat)-60.)/20.,0,1)+0*surface}[filetype]
+                    data=(('MT','Y','X'),field[np.newaxis].astype(np.float32))
+                    ds=xr.Dataset({godae.rtofs_vars[filetype][0]:data},coords=coords)
+                ds.to_netcdf(fname)
+#----------------------------------------------------------------
+def write_class4(vDate,params,nobs,ndeps,seed=0):
+    """
+    GODAE class4 files for vDate, gzipped and encrypted like the downloads
+    """
+    rng=np.random.default_rng(seed)
+    days=(vDate-pd.Timestamp(1950,1,1)).days
+    for param in params:
+        obs_type,nvars,filename=class4_files[param]
+        # up to the fold, ice only in the polar seas
+        lon=rng.uniform(-180.,180.,nobs)
+        if param=='aice':
+            lat=rng.uniform(60.,90.,nobs)*rng.choice([-1.,1.],nobs)
+            lat=np.maximum(lat,-78.)
+        else:
+            lat=rng.uniform(-70.,90.,nobs)
+        nfcsts=10 if param=='aice' else 6
+        nd=ndeps if param=='profile' else 1
+        depth=np.sort(rng.uniform(0.,2000.,(nobs,nd)),axis=1) if nd>1 else np.zeros((nobs,1))
+        ds=xr.Dataset({'longitude':('numobs',lon),
+                       'latitude':('numobs',lat),
+                       'depth':(('numobs','numdeps'),depth.astype(np.float32)),
+                       'observation':(('numobs','numvars','numdeps'),rng.normal(15.,2.,(nobs,nvars,nd)).astype(np.float32)),
+                       'forecast':(('numobs','numvars','numfcsts','numdeps'),np.zeros((nobs,nvars,nfcsts,nd),np.float32)),
+                       'climatology':(('numobs','numvars','numdeps'),np.zeros((nobs,nvars,nd),np.float32)),
+                       'leadtime':(('numfcsts',),np.arange(nfcsts,dtype=np.float32))})
+        units={'units':'days since 1950-01-01 00:00:00'}
+        if param=='SLA':
+            ds['mdt_reference']=(('numobs','numvars','numdeps'),np.zeros((nobs,nvars,nd),np.float32))
+        if param=='aice':
+            ds['obs_time']=('numobs',days+rng.uniform(0.,1.,nobs),units)
+        else:
+            ds['juld']=('numobs',days+rng.uniform(0.,1.,nobs),units)
+            ds['modeljuld']=('numobs',np.full(nobs,days+0.),units)
+        ds.attrs['obs_type']=obs_type
+        fname=f'{godae.godaeDir}/incoming/{filename.format(vDate)}'
+        if 'FOAM' in filename and vDate>=godae.foam_sha256:
+            digest='sha256'
+        else:
+            digest='md5'
+        data=ds.to_netcdf(None,format='NETCDF3_CLASSIC')
+        godae.encrypt_stream(godae.gzip_blocks(data),f'{fname}.gz.enc',digest=digest)
+#----------------------------------------------------------------
+def write_climo(res):
+    """
+    12 HYCOM monthly mean SSH files on a regular res degree grid
+    """
+    lon=np.arange(0.,360.,res)
+    lat=np.arange(-80.,90.+res/2,res)
+    for month in range(1,13):
+        field=np.sin(np.deg2rad(lat))[:,np.newaxis]*np.cos(np.deg2rad(lon))+month/10.
+        field[np.abs(lat-10.)<4.]=np.nan
+        ds=xr.Dataset({'surf_el':(('time','lat','lon'),field[np.newaxis].astype(np.float32))},
+                      coords={'time':[0.],'lat':lat,'lon':lon})
+        ds.to_netcdf(godae.climo_file(month))
+#----------------------------------------------------------------
+def timed(timings,stage,repeat,func,*args):
+    """
+    Run func repeat times, record the wall time of each run and return
+    the last result
+    """
+    times=[]
+    for n in range(repeat):
+        start=time.perf_counter()
+        result=func(*args)
+        times.append(time.perf_counter()-start)
+    timings[stage]={'times':times,'min':min(times),'mean':sum(times)/len(times)}
+    return result
+#----------------------------------------------------------------
+def rebuild_grid_index(grid):
+    indexfile=f'{godae.tempDir}/godae/rtofs_grid_index.pkl'
+    if os.path.exists(indexfile):
+        os.remove(indexfile)
+    godae._grid_index=None
+    return godae.get_grid_index(grid)
+#----------------------------------------------------------------
+def rebuild_hycom_mdt():
+    for fname in ['hycom_mdt.npy','hycom_mdt_grid.pkl']:
+        if os.path.exists(f'{godae.tempDir}/godae/{fname}'):
+            os.remove(f'{godae.tempDir}/godae/{fname}')
+    godae._climo=None
+    return godae.get_hycom_mdt()
+#----------------------------------------------------------------
+def bench_param(vDate,param,repeat):
+    """
+    Time every stage of one date for one param, the same sequence as
+    process_date and write_product
+    """
+    timings={}
+    obs=timed(timings,'get_godae',repeat,godae.get_godae,vDate,param)
+    grid=godae.get_grid(vDate,obs)
+    timed(timings,'grid_index',repeat,rebuild_grid_index,grid)
+    stencil=timed(timings,'stencil',repeat,godae.get_stencil,grid,obs)
+    model=timed(timings,'get_rtofs_mean',repeat,godae.get_rtofs_mean,vDate,obs,stencil)
+    persist=godae.get_rtofs_mean(vDate,obs,stencil,True)
+    climo=None
+    if param=='SLA':
+        timed(timings,'hycom_mdt_cache',repeat,rebuild_hycom_mdt)
+        climo=timed(timings,'get_hycom_climo',repeat,godae.get_hycom_climo,vDate,obs)
+        model['sla']=model.ssh-climo
+        persist['sla']=persist.ssh-climo
+        del model['ssh'], persist['ssh']
+    if param=='profile':
+        timed(timings,'depth_interp',repeat,godae.depth_interp,model.temperature,obs)
+    best_estimate=persist.isel({'MT':[0]})
+    obs2=timed(timings,'create_dataset',repeat,godae.create_dataset,param,model,persist,best_estimate,obs,climo)
+    timed(timings,'write_product',repeat,godae.write_product,obs2,vDate,param)
+    timed(timings,'class4_stats',repeat,godae.class4_stats,obs2,vDate,param)
+    return timings
+#----------------------------------------------------------------
+def versions():
+    import scipy, dask
+    return {'python':platform.python_version(),
+            'numpy':np.__version__,
+            'pandas':pd.__version__,
+            'xarray':xr.__version__,
+            'scipy':scipy.__version__,
+            'dask':dask.__version__,
+            'cryptography':godae.Cipher is not None}
+# main routine starts here
+if __name__ == '__main__':
+
+    parser=argparse.ArgumentParser(description='Benchmark the GODAE class-4 processing on synthetic data')
+    parser.add_argument('params',nargs='*',default=['profile','SST','SLA','aice'],help='params to time (default: all)')
+    parser.add_argument('--date',default='20230110',help='valid date YYYYMMDD (default: 20230110)')
+    parser.add_argument('--nx',type=int,default=480,help='RTOFS grid X size (default: 480)')
+    parser.add_argument('--ny',type=int,default=360,help='RTOFS grid Y size (default: 360)')
+    parser.add_argument('--nz',type=int,default=20,help='RTOFS levels (default: 20)')
+    parser.add_argument('--nobs',type=int,default=5000,help='obs per class4 file (default: 5000)')
+    parser.add_argument('--ndeps',type=int,default=30,help='depths per profile (default: 30)')
+    parser.add_argument('--climo-res',type=float,default=0.5,help='HYCOM climo grid spacing, degrees (default: 0.5)')
+    parser.add_argument('--repeat',type=int,default=3,help='runs of each stage (default: 3)')
+    parser.add_argument('--scheduler',default='threads',help='dask scheduler, see godae_rtofsv2.py (default: threads)')
+    parser.add_argument('--dask-workers',type=int,default=None,help='dask workers (default: SLURM_NTASKS or cpu count)')
+    parser.add_argument('--workdir',help='directory for the synthetic data (default: a new temporary one)')
+    parser.add_argument('--keep',action='store_true',help='keep the synthetic data')
+    parser.add_argument('--output',help='JSON results file (default: stdout)')
+    args=parser.parse_args()
+
+    vDate=pd.Timestamp(args.date)
+    root=args.workdir or tempfile.mkdtemp(prefix='godae_benchmark_')
+    set_dirs(root)
+    client=godae.set_scheduler(args.scheduler,args.dask_workers)
+
+    print('writing synthetic data to',root)
+    start=time.perf_counter()
+    write_rtofs(vDate,args.params,args.ny,args.nx,args.nz)
+    write_class4(vDate,args.params,args.nobs,args.ndeps)
+    if 'SLA' in args.params:
+        write_climo(args.climo_res)
+    generate=time.perf_counter()-start
+
+    results={'created':f'{datetime.now():%Y-%m-%dT%H:%M:%S}',
+             'host':platform.node(),
+             'versions':versions(),
+             'config':{key:value for key,value in vars(args).items() if key not in ('output','keep')},
+             'generate_seconds':generate,
+             'stages':{}}
+    try:
+        for param in args.params:
+            print('timing',param)
+            results['stages'][param]=bench_param(vDate,param,args.repeat)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(root,ignore_errors=True)
+
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(results,f,indent=1)
+        print('wrote',args.output)
+    else:
+        print(json.dumps(results,indent=1))
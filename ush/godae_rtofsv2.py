@@ -9,7 +9,7 @@ Notes
     Four types:  profile, SST, SLA, aice (ice)
     Processing sequence:
         Load appropriate GODAE dataset
-        Load 8 days of Global RTOFS data (open_mfdataset)
+        Load 8 days of Global RTOFS data (the columns under the stencil)
         	Note that profiles are 3D, SLA, SST, and ice are 2D
         Interpolate MDT from HYCOM 30-year average for SLA calculation
         Interpolate RTOFS to GODAE locations (2D bilinear,linear in Z)
@@ -21,9 +21,11 @@ Notes
         Load new data into nc file
         Compress and encrypt nc file
         
+        Accumulate class-4 statistics of the new file (class4_stats)
+        
         In separate V&V job:
         Plot profiles, SST, SLA, and ice concentration values
-        Compute statistics and save to dbase
+        Merge statistics by month or year (class4_stats.py)
         Plot accumulated statistics
         
     Working Definitions:
@@ -40,12 +42,36 @@ import warnings
 warnings.filterwarnings("ignore")
 import pandas as pd
 import xarray as xr
-import xesmf as xe
+import dask
 import numpy as np
-import scipy.interpolate as sip
+import scipy.spatial as spatial
+import scipy.sparse as sparse
 from datetime import datetime, timedelta
 import subprocess
+import hashlib
+import zlib
+import io
+import pickle
+import mmap
+import json
+import time
+import resource
+import contextlib
+import cProfile
+import pstats
+import argparse
+import threading
+import concurrent.futures
 import os, sys
+try:
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:  # encrypt with the openssl command instead
+    Cipher=None
+try:
+    import zarr
+except ImportError:  # read the NetCDF archive only
+    zarr=None
 #import ipdb
 
 baseDir='/scratch2/NCEPDEV/ocean/Deanna.Spindler/noscrub'
@@ -55,24 +81,84 @@ tempDir='/scratch2/NCEPDEV/stmp1/Deanna.Spindler'
 climoDir=f'{baseDir}/Global/climo/HYCOM'
 godaeDir=f'{baseDir}/GODAE'
 modelDir=f'{baseDir}/Global/archive'
+_grid=None         # RTOFS lon/lat, shared by every param and date
+_grid_index=None   # RTOFS grid KD-tree, shared by every param and date
+_grid_lock=threading.RLock()
+_climo=None        # HYCOM monthly MDT, memory mapped from the cache in tempDir
+_climo_lock=threading.Lock()
+_read_locks={}     # one lock per cached RTOFS file, so threads read it once
+_read_locks_lock=threading.Lock()
+rtofsTile=64   # Y/X dask chunk for column reads, all depths in one chunk
+gzipBlock=4*1024*1024  # bytes per gzip member, members are compressed in parallel
+gzipWorkers=4
+openssl='/usr/bin/openssl'
+godae_pass='ire15aus6'
+godae_digest='md5'  # openssl enc key digest for our products, the old openssl default
+foam_sha256=pd.Timestamp(2022,12,27)  # FOAM files use -md sha256 from this date on
+product_version=2.0
+
+# RTOFS file names, file types by obs_type
+# nowcasts and forecasts out to 168 ... only need out to 144
+rtofs_fcsts=np.arange(0,193,24)
+#rtofs_fcsts=np.arange(0,145,24)
+rtofs_template='{}/{}/rtofs_glo_{}_{}{:03n}_{}.nc'
+rtofs_zarr_template='{}/{}/rtofs_glo_{}_{}.zarr'  # all leads of a day, see rtofs_zarr.py
+rtofs_ftypes={'profile':['daily_3ztio','daily_3zsio'],
+              'SST':['prog'],
+              'SLA':['diag'],
+              'AMSR2 brightness temperature':['ice']}  # this is ice
+# param -> obs_type of its GODAE file
+obs_types={'profile':'profile','SST':'SST','SLA':'SLA','aice':'AMSR2 brightness temperature'}
+# RTOFS file type -> file group and the variables read from it
+rtofs_dims={'daily_3ztio':'3dz','daily_3zsio':'3dz','prog':'2ds','diag':'2ds','ice':'2ds'}
+rtofs_vars={'daily_3ztio':['temperature'],'daily_3zsio':['salinity'],
+            'prog':['sst'],'diag':['ssh'],'ice':['ice_coverage']}
+
+# param -> RTOFS variables averaged for the 12Z mean
+data_keys={'profile':['temperature','salinity'],
+           'aice':['ice'],
+           'SLA':['ssh'],
+           'SST':['sst']}
+
+# param -> class4 layout of the model values
+#   vars  -- model variables, in numvars order
+#   leads -- MT slice of the 12Z means that is written
+#   fcsts -- numfcsts slice the leads go to
+#   times -- update modeljuld and leadtime
+class4_layout={'profile':{'vars':['temperature','salinity'],'leads':slice(1,7),'fcsts':slice(None),'times':True},
+               'SST':{'vars':['sst'],'leads':slice(1,7),'fcsts':slice(None),'times':True},
+               'SLA':{'vars':['sla'],'leads':slice(1,7),'fcsts':slice(None),'times':True},
+               'aice':{'vars':['ice'],'leads':slice(0,9),'fcsts':slice(0,9),'times':False}}
+# class-4 statistics, see class4_stats
+#   profile_depths -- upper edges of the profile depth bins (m), the other
+#                     params have one surface bin at 0
+#   stats_regions  -- region -> (south, north, west, east), west > east
+#                     wraps through the dateline
+profile_depths=[10.,20.,50.,100.,200.,300.,500.,700.,1000.,1500.,2000.,3000.,5000.]
+stats_regions={'global':(-90,90,-180,180),
+               'arctic':(66.5,90,-180,180),
+               'north':(20,90,-180,180),
+               'tropics':(-20,20,-180,180),
+               'south':(-90,-20,-180,180),
+               'southern_ocean':(-90,-50,-180,180)}
+stats_moments=['sum_error','sumsq_error','sum_abs_error','sum_obs','sumsq_obs',
+               'sum_model','sumsq_model','sum_obs_model']
+fcst_comment='12Z time average of 00Z model forecast and forecast+24h daily instantaneous fields'
+nowcast_comment='12Z time average of 00Z model nowcast and nowcast+24h daily instantaneous fields'
 
 #----------------------------------------------------------------
 def godae_fix(data,param):
     """
     Fix the bad GODAE data sets
+    
+    Decode the days since the reference date to datetime64[ns] for the
+    whole array at once, NaN days become NaT.
     """
-    def nan2nat(ref,day):
-        #convert nan to NaT
-        td = pd.NaT
-        if not np.isnan(day):
-            td = pd.Timedelta(days=day)
-        return pd.Timestamp(ref) + td
-        
-    jd = [nan2nat(data[param].units.split()[2],day) for day in data[param].values.tolist()]
-    ds = xr.Dataset({param: (data[param].dims, jd, {'units': 'ns'})}) # Update the units attribute appropriately
-    ds = xr.decode_cf(ds)
-    ds[param].attrs={}
-    data[param]=ds[param]
+    ref=pd.Timestamp(data[param].units.split()[2])
+    days=np.asarray(data[param].values,dtype=np.float64)
+    ns=np.trunc(days.ravel()*24*3600*1_000_000_000)  # as pd.Timedelta(days=day)
+    jd=ref+pd.to_timedelta(ns,unit='ns')
+    data[param]=(data[param].dims,jd.values.reshape(days.shape))
     return data
 
 #----------------------------------------------------------------
@@ -80,116 +166,370 @@ def get_godae(theDate,parameter):
     """
     Decrypt the ncfile and read into memory
     parameter='profile','SLA','SST','aice'
+    
+    The downloaded .nc.gz.enc file is decrypted and unzipped in memory, a
+    plain .nc file is read instead if that is all there is.
     """
-    if parameter=='aice':        
-        filename=f'class4_{theDate:%Y%m%d}_GIOPS_CONCEPTS_3.3_{parameter}.nc'
-    else:
-        filename=f'class4_{theDate:%Y%m%d}_FOAM_orca025_14.1_{parameter}.nc'
-        
+    filename=godae_filename(theDate,parameter)
     fn=f'{godaeDir}/incoming/{filename}'
-    if os.path.exists(fn):
+    if os.path.exists(f'{fn}.gz.enc'):
         try:
-            data=xr.open_dataset(fn,decode_times=True)        
-            return data
-        except:
-            try:
-                data=xr.open_dataset(fn,decode_times=False)
-                data=godae_fix(data,'juld')
-                data=godae_fix(data,'modeljuld')
-                return data
-            except:
-                print('Problem opening file:',filename)
-                return None 
+            source=gunzip(decrypt_blocks(f'{fn}.gz.enc',digest=class4_digest(theDate,parameter)))
+        except OSError as e:
+            print('Problem decrypting file:',filename,e)
+            return None
+    elif os.path.exists(fn):
+        source=fn
     else:
         print('File Not Found:',filename)
         return None
+    try:
+        data=open_godae(source,decode_times=True)        
+        return data
+    except:
+        try:
+            data=open_godae(source,decode_times=False)
+            data=godae_fix(data,'juld')
+            data=godae_fix(data,'modeljuld')
+            return data
+        except:
+            print('Problem opening file:',filename)
+            return None 
 #----------------------------------------------------------------
-def get_rtofs(vDate,obs,wantPersist=False):
+def godae_filename(theDate,parameter):
     """
-    Load nowcast/fcst from local archive.  wantPersist gets nowcasts aligned with 
-    valid date.
-
-    The FOAM (UKMET) GODAE data set has daily mean fields centered at
-	12Z.  RTOFS doesn't produce daily means, but we can estimate it by
-	averaging between two model days to get the 00Z mean field.
-
-    RTOFS v2 now reports valid time in MT, but no forecast hour.  File open needs to be multi-step,
-    with each forecast separately loaded, and each forecast appended or concatenated to form the full
-    dask array.
+    name of the GODAE class4 file, without the .gz.enc of the download
+    """
+    if parameter=='aice':        
+        return f'class4_{theDate:%Y%m%d}_GIOPS_CONCEPTS_3.3_{parameter}.nc'
+    return f'class4_{theDate:%Y%m%d}_FOAM_orca025_14.1_{parameter}.nc'
+#----------------------------------------------------------------
+def class4_digest(theDate,parameter):
+    """
+    openssl -md digest of the downloaded class4 file, FOAM changed to
+    sha256 on 20221227, GIOPS still uses md5
+    """
+    if parameter=='aice':
+        return 'md5'
+    return 'sha256' if theDate>=foam_sha256 else 'md5'
+#----------------------------------------------------------------
+def open_godae(source,**kwargs):
+    """
+    Open a GODAE file from its path or from the file contents in memory.
+    Classic netcdf is read with scipy, netcdf-4 through netCDF4's memory
+    buffer.
+    """
+    if isinstance(source,str):
+        return xr.open_dataset(source,**kwargs)
+    if source[:4]==b'\x89HDF':
+        import netCDF4
+        nc=netCDF4.Dataset('class4.nc',memory=source)
+        return xr.open_dataset(xr.backends.NetCDF4DataStore(nc),**kwargs)
+    return xr.open_dataset(io.BytesIO(source),engine='scipy',**kwargs)
+#----------------------------------------------------------------
+def rtofs_file(runDate,ftype,fcst_hrs,filetype):
+    """
+    archive path of one RTOFS file, ftype is 'n' or 'f'
+    """
+    return rtofs_template.format(modelDir,runDate.strftime('%Y%m%d'),rtofs_dims[filetype],ftype,fcst_hrs,filetype)
+#----------------------------------------------------------------
+def rtofs_zarr(runDate,filetype):
+    """
+    archive path of the zarr mirror of one day and file type
+    """
+    return rtofs_zarr_template.format(modelDir,runDate.strftime('%Y%m%d'),rtofs_dims[filetype],filetype)
+#----------------------------------------------------------------
+if zarr is not None and zarr.__version__.startswith('2.'):
+    class MemoryMappedDirectoryStore(zarr.storage.DirectoryStore):
+        """
+        zarr 2 directory store that memory maps the chunk files
+        """
+        def _fromfile(self,fn):
+            with open(fn,'rb') as f:
+                return memoryview(mmap.mmap(f.fileno(),0,prot=mmap.PROT_READ))
+#----------------------------------------------------------------
+def rtofs_zarr_leads(store):
+    """
+    the leads completely written to a zarr mirror store, listed one per
+    line in {store}.leads by rtofs_zarr.py once each append has finished
+    """
+    if not os.path.exists(f'{store}.leads'):
+        return []
+    with open(f'{store}.leads') as f:
+        return f.read().split()
+#----------------------------------------------------------------
+def open_rtofs_zarr(key):
+    """
+    Lazy dataset of one lead from the zarr mirror, key is (run date, file
+    type, lead).  None if there is no mirror or the lead is not complete
+    in it yet, a lead still being appended is never read.  With zarr 2 the
+    chunk files are memory mapped.
+    """
+    runDate,filetype,lead=key
+    store=rtofs_zarr(runDate,filetype)
+    if zarr is None or lead not in rtofs_zarr_leads(store):
+        return None
+    try:
+        if zarr.__version__.startswith('2.'):
+            ds=xr.open_zarr(MemoryMappedDirectoryStore(store),chunks={})
+        else:
+            ds=xr.open_zarr(store,chunks={})
+    except (OSError,KeyError,ValueError) as e:  # metadata of an append in progress
+        print('Problem opening',store,e)
+        return None
+    return ds.sel(lead=lead).drop_vars('lead')
+#----------------------------------------------------------------
+def get_grid(vDate,obs):
+    """
+    RTOFS lon/lat with the old lon fix, read from the valid date nowcast.
+    The grid is the same for every file type, so it is read once per process.
+    """
+    global _grid
+    with _grid_lock:
+        if _grid is None:
+            ds=xr.open_dataset(rtofs_file(vDate,'n',24,rtofs_ftypes[obs.obs_type][0]))
+            grid=xr.Dataset(coords={'lon':(('Y','X'),ds.Longitude.values),
+                                    'lat':(('Y','X'),ds.Latitude.values)})
+            ds.close()
+            grid['lon'][-1,]=grid.lon[-2,]  # the old lon fix
+            _grid=grid
+        return _grid
+#----------------------------------------------------------------
+def read_rtofs(fname,key,stencil,cache=None,columns=None):
+    """
+    Open one RTOFS file, cut out the stencil columns and decode them.
+    key is (run date, file type, lead).  A file already in the cache is 
+    not opened again.
     
+    columns is the set of columns read when the file is not cached yet,
+    by default the stencil.  In date range mode it covers every date still
+    to come that will use the file.
     """
-    template='{}/{}/rtofs_glo_{}_{}{:03n}_{}.nc'
-    fnames=[]
-    data=xr.Dataset()
-    # nowcasts and forecasts out to 168 ... only need out to 144
-    all_fcsts=np.arange(0,193,24)
-    #all_fcsts=np.arange(0,145,24)
-    all_fnames={}
-    for fcst in all_fcsts:
-        fnames=[]
+    if columns is None:
+        columns=stencil
+    if cache is None:
+        return read_columns(fname,key,columns).sel(cell=stencil['cells'])
+    with _read_locks_lock:
+        lock=_read_locks.setdefault(key,threading.Lock())
+    with lock:
+        if key not in cache:
+            cache[key]=read_columns(fname,key,columns)
+        ds=cache[key]
+    return ds.sel(cell=stencil['cells'])
+#----------------------------------------------------------------
+def read_columns(fname,key,columns):
+    """
+    decode the columns of one RTOFS file, indexed by their flat grid cell.
+    The lead comes from the day's zarr mirror when it is there, the chunks
+    are then decoded in parallel without the HDF5 lock, otherwise from the
+    NetCDF file.
+    """
+    start=time.perf_counter()
+    ds=open_rtofs_zarr(key)
+    if ds is None:
+        ds=xr.open_dataset(fname,decode_times=True,chunks={'Y':rtofsTile,'X':rtofsTile})
+        file_size=os.path.getsize(fname)
+    else:
+        fname=rtofs_zarr(key[0],key[1])
+        file_size=None
+    ds=get_columns(ds[rtofs_vars[key[1]]].squeeze(),columns).load(scheduler=read_scheduler())
+    ds.close()
+    ds.coords['cell']=columns['cells']
+    # for the run report
+    ds.encoding['read']={'file':fname,
+                         'seconds':round(time.perf_counter()-start,4),
+                         'bytes':int(ds.nbytes),
+                         'file_size':file_size}
+    return ds
+#----------------------------------------------------------------
+def rtofs_files(vDate,obs,wantPersist=False):
+    """
+    Find the RTOFS files for every forecast lead valid at vDate.
+    Returns (fcst, runDate, lead, filenames, filetypes) for each lead.  All
+    missing files are reported at once, before anything is read.
+    """
+    files=rtofs_leads(vDate,obs.obs_type,wantPersist)
+    missing=[fname for f in files for fname in f[3] if not os.path.exists(fname)]
+    if len(missing):
+        for fname in missing:
+            print('File Not Found:',fname)
+        raise FileNotFoundError(f'{len(missing)} RTOFS files missing for {vDate:%Y%m%d}')
+    return files
+#----------------------------------------------------------------
+def rtofs_leads(vDate,obs_type,wantPersist=False):
+    """
+    the RTOFS file names of every forecast lead valid at vDate, see rtofs_files
+    """
+    ftypes=rtofs_ftypes[obs_type]
+    files=[]
+    for fcst in rtofs_fcsts:
         runDate=vDate-timedelta(fcst/24.)
         ftype='f'
         fcst_hrs=fcst
         # nowcast names are different.  This changes for rtofsv2
-        if fcst == 0:
+        if fcst == 0 or wantPersist:
             ftype='n'
             fcst_hrs=24
-        
-        if obs.obs_type=='profile':
-            if wantPersist:
-                fnames.extend([template.format(modelDir,runDate.strftime('%Y%m%d'),'3dz','n',24,i) for i in ['daily_3ztio','daily_3zsio']])
-            else:
-                fnames.extend([template.format(modelDir,runDate.strftime('%Y%m%d'),'3dz',ftype,fcst_hrs,i) for i in ['daily_3ztio','daily_3zsio']])
-            all_fnames[fcst]=fnames[-2:]
-        else:
-            if obs.obs_type=='SST':
-                if wantPersist:
-                    fnames.append(template.format(modelDir,runDate.strftime('%Y%m%d'),'2ds','n',24,'prog'))
-                else:
-                    fnames.append(template.format(modelDir,runDate.strftime('%Y%m%d'),'2ds',ftype,fcst_hrs,'prog'))
-            elif obs.obs_type=='SLA':
-                if wantPersist:
-                    fnames.append(template.format(modelDir,runDate.strftime('%Y%m%d'),'2ds','n',24,'diag'))
-                else:
-                    fnames.append(template.format(modelDir,runDate.strftime('%Y%m%d'),'2ds',ftype,fcst_hrs,'diag'))
-            elif obs.obs_type=='AMSR2 brightness temperature': # this is ice
-                if wantPersist:
-                    fnames.append(template.format(modelDir,runDate.strftime('%Y%m%d'),'2ds','n',24,'ice'))
-                else:
-                    fnames.append(template.format(modelDir,runDate.strftime('%Y%m%d'),'2ds',ftype,fcst_hrs,'ice'))
-            all_fnames[fcst]=fnames[-1]
-        ds=xr.open_mfdataset(fnames,decode_times=True)
-        
-        # set MT from valid time to run time, as it used to be
-        ds=ds.squeeze()
-        ds.coords['MT']=runDate
-        if data.nbytes==0:
-            data=ds.copy()
-        else:
-            # removed combine_attrs since newer version of xarray, Aug 2021
-            #data=xr.concat([data,ds],'MT',combine_attrs='no_conflicts')
-            data=xr.concat([data,ds],'MT')
+        lead=f'{ftype}{fcst_hrs:03n}'
+        files.append((fcst,runDate,lead,[rtofs_file(runDate,ftype,fcst_hrs,i) for i in ftypes],ftypes))
+    return files
+#----------------------------------------------------------------
+def get_rtofs_lead(lead_files,stencil,cache=None,columns=None):
+    """
+    Load the stencil columns of one forecast lead from rtofs_files, with MT
+    set to the run date.
+    """
+    fcst,runDate,lead,fnames,ftypes=lead_files
+    ds=xr.merge([read_rtofs(fname,(runDate,i,lead),stencil,cache,columns) for fname,i in zip(fnames,ftypes)])
+    ds.coords['MT']=runDate
+    return ds
+#----------------------------------------------------------------
+def read_scheduler():
+    """
+    The RTOFS reads and the read cache stay in this process, in threads,
+    whatever backend runs the other tasks.  One at a time with the
+    synchronous scheduler.
+    """
+    if dask.config.get('scheduler',None) in ('synchronous','sync','single-threaded'):
+        return 'synchronous'
+    return 'threads'
+#----------------------------------------------------------------
+def column_values(ds):
+    """
+    the stencil column arrays of a dataset from read_rtofs, (..., cell)
+    """
+    return {key:ds[key].transpose(...,'cell').values for key in ds.data_vars if 'cell' in ds[key].dims}
+#----------------------------------------------------------------
+def get_rtofs_mean(vDate,obs,stencil,wantPersist=False,cache=None,columns=None):
+    """
+    12Z daily mean at the GODAE locations, the average of the 00Z fields
+    valid at vDate and vDate+1.  MT is the day 1 run date plus 12 hours.
+    wantPersist gets nowcasts aligned with valid date.
+
+    The FOAM (UKMET) GODAE data set has daily mean fields centered at
+    12Z.  RTOFS doesn't produce daily means, but we can estimate it by
+    averaging between two model days.  RTOFS v2 reports valid time in MT,
+    but no forecast hour, every lead is a separate file.
     
-    data=data.rename({'Longitude':'lon','Latitude':'lat'})
-    data=data.squeeze()
+    Only the stencil columns are read, in threads of this process through
+    the shared cache (read_scheduler).  The two instants of each lead are
+    then averaged and sampled to the obs points as parallel dask tasks on
+    plain arrays, so any backend can run them, and only the
+    (nfcst, [depth,] nobs) result is held in full.
+    """
+    files1=rtofs_files(vDate,obs,wantPersist)
+    files2=rtofs_files(vDate+timedelta(1),obs,wantPersist)
+    leads=dask.compute(*[dask.delayed(get_rtofs_lead)(lead_files,stencil,cache,columns) for lead_files in files1+files2],
+                       scheduler=read_scheduler())
+    leads1,leads2=leads[:len(files1)],leads[len(files1):]
+    weights=dask.delayed(stencil['weights'])  # sent to the workers once
+    means=dask.compute(*[dask.delayed(stencil_mean)(column_values(ds1),column_values(ds2),weights)
+                         for ds1,ds2 in zip(leads1,leads2)])
+    data=None
+    all_fnames={}
+    for n,(lead1,ds1,mean) in enumerate(zip(files1,leads1,means)):
+        all_fnames[lead1[0]]=lead1[3] if obs.obs_type=='profile' else lead1[3][-1]
+        if data is None:
+            data=xr.Dataset(coords={'lon':('locations',obs.longitude.values),
+                                    'lat':('locations',obs.latitude.values)})
+            if 'Depth' in ds1.coords:
+                data.coords['Depth']=ds1.Depth.values
+            for key in mean:
+                da=ds1[key].transpose(...,'cell')
+                data[key]=(('MT',)+da.dims[:-1]+('locations',),np.empty((rtofs_fcsts.size,)+mean[key].shape,mean[key].dtype),da.attrs)
+        for key in mean:
+            data[key].values[n]=mean[key]
     
-    if obs.obs_type=='SST':
-        data=data['sst'].to_dataset()
-    elif obs.obs_type=='SLA':
-        data=data['ssh'].to_dataset()
-    elif obs.obs_type=='AMSR2 brightness temperature':
-        data=data['ice_coverage'].to_dataset()
+    if 'ice_coverage' in data:
         data=data.rename({'ice_coverage':'ice'})  # match param to varname
-                        
-    data.coords['forecast']=(('nfcst',),all_fcsts)
+    data.coords['MT']=pd.DatetimeIndex([f[1] for f in files1])+pd.Timedelta('0.5d')
+    data.coords['forecast']=(('nfcst',),rtofs_fcsts)
     data.attrs['input_files']=all_fnames
-    data['lon'][-1,]=data.lon[-2,]  # the old lon fix
-
     return data
 #----------------------------------------------------------------
-def get_hycom_climo(vDate,rtofs):
+def climo_file(month):
+    return "{0}/hycom_GLBv0.08_53X_archMN.1994_{1:02n}_2015_{1:02n}_ssh.nc".format(climoDir,month)
+#----------------------------------------------------------------
+def get_hycom_mdt():
+    """
+    The 12 HYCOM monthly mean SSH fields, memory mapped from a cache under
+    tempDir/godae.  The cache is written once from the climo files and is 
+    only rebuilt if they change, an SLA date then only reads the pages 
+    under its stencil.
+    """
+    global _climo
+    files=[climo_file(month) for month in range(1,13)]
+    signature=[(os.path.basename(f),os.path.getsize(f),int(os.path.getmtime(f))) for f in files]
+    with _climo_lock:
+        if _climo is None or _climo['signature']!=signature:
+            _climo=load_hycom_mdt(files,signature)
+        return _climo
+#----------------------------------------------------------------
+def load_hycom_mdt(files,signature):
+    """
+    open the cached MDT fields, or build a new cache from the climo files
+    """
+    gridfile=f'{tempDir}/godae/hycom_mdt_grid.pkl'
+    mdtfile=f'{tempDir}/godae/hycom_mdt.npy'
+    if os.path.exists(gridfile) and os.path.exists(mdtfile):
+        with open(gridfile,'rb') as f:
+            climo=pickle.load(f)
+        if climo['signature']==signature:
+            climo['mdt']=np.load(mdtfile,mmap_mode='r')
+            return climo
+    print('building HYCOM MDT cache')
+    os.makedirs(os.path.dirname(mdtfile),exist_ok=True)
+    tmpfile=f'{mdtfile}.{os.getpid()}.npy'
+    mdt=None
+    for n,fname in enumerate(files):
+        with xr.open_dataset(fname,decode_times=False) as data:
+            field=data['surf_el'].squeeze()
+            if mdt is None:
+                climo={'signature':signature,
+                       'lon':field.lon.values.astype(np.float64),
+                       'lat':field.lat.values.astype(np.float64),
+                       'attrs':dict(field.attrs)}
+                mdt=np.lib.format.open_memmap(tmpfile,mode='w+',dtype=field.dtype,
+                                              shape=(len(files),)+field.shape)
+            mdt[n]=field.values
+    mdt.flush()
+    del mdt
+    os.replace(tmpfile,mdtfile)
+    tmpfile=f'{gridfile}.{os.getpid()}'
+    with open(tmpfile,'wb') as f:
+        pickle.dump(climo,f,protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpfile,gridfile)
+    climo['mdt']=np.load(mdtfile,mmap_mode='r')
+    return climo
+#----------------------------------------------------------------
+def get_climo_stencil(climo,obs):
     """
-    get MDT from 30-year HYCOM dataset and add it as mdt_reference
+    Bilinear stencil for the GODAE locations on the regular HYCOM grid,
+    same layout as get_stencil.  The cell is found by a binary search in
+    lon and lat, and wraps in lon when the grid is global.
+    """
+    lon,lat=climo['lon'],climo['lat']
+    ny,nx=lat.size,lon.size
+    periodic=lon[0]+360-lon[-1]<=np.diff(lon).max()*1.01
+    x=(obs.longitude.values-lon[0])%360+lon[0]
+    y=obs.latitude.values
+    i=np.searchsorted(lon,x,side='right')-1
+    if not periodic:
+        i=np.minimum(i,nx-2)
+    i1=(i+1)%nx
+    j=np.clip(np.searchsorted(lat,y)-1,0,ny-2)
+    with np.errstate(all='ignore'):
+        s=(x-lon[i])/((lon[i1]-lon[i])%360)
+        t=(y-lat[j])/(lat[j+1]-lat[j])
+        found=np.flatnonzero((s>=0)&(s<=1)&(t>=0)&(t<=1))
+    if found.size<y.size:
+        print(f'{y.size-found.size} GODAE locations not mapped to the HYCOM grid')
+    return make_stencil(y.size,found,j[found],i[found],s[found],t[found],(ny,nx))
+#----------------------------------------------------------------
+def get_hycom_climo(vDate,obs,stencil=None):
+    """
+    get MDT from 30-year HYCOM dataset at the GODAE locations, used for 
+    mdt_reference and the SLA
     
     Read HYCOM 1995-2015 mean data
     This is used for the mssh values
@@ -197,12 +537,20 @@ def get_hycom_climo(vDate,rtofs):
     HYCOM monthly data is centered on mid-month, scale theDate against
 	the date range to create a weighted average of the straddling
 	month fields.    
+	
+	The monthly fields come from the memory mapped cache, each month is
+	sampled at the stencil cells before they are blended.
     """
+    climo=get_hycom_mdt()
+    if stencil is None:
+        stencil=get_climo_stencil(climo,obs)
+        
+    def read_month(month):
+        field=climo['mdt'][month-1].reshape(-1)
+        return stencil['weights'] @ field[stencil['cells']]
 
     if vDate.day==15:  # even for Feb, just because
-        climofile="hycom_GLBv0.08_53X_archMN.1994_{0:02n}_2015_{0:02n}_ssh.nc".format(vDate.month)
-        data=xr.open_dataset(climoDir+'/'+climofile,decode_times=False)
-        data=data['surf_el'].copy().squeeze()
+        data=read_month(vDate.month)
     else:  # need to scale things
         if vDate.day < 15:
             start=pd.Timestamp(vDate.year,vDate.month,15)+pd.tseries.offsets.DateOffset(months=-1)
@@ -212,297 +560,346 @@ def get_hycom_climo(vDate,rtofs):
             stop=pd.Timestamp(vDate.year,vDate.month,15)+pd.tseries.offsets.DateOffset(months=1)
         left=(vDate-start)/(stop-start)
         #right=(stop-vDate)/(stop-start)
-        climofile1="hycom_GLBv0.08_53X_archMN.1994_{0:02n}_2015_{0:02n}_ssh.nc".format(start.month)
-        climofile2="hycom_GLBv0.08_53X_archMN.1994_{0:02n}_2015_{0:02n}_ssh.nc".format(stop.month)
-        data1=xr.open_dataset(climoDir+'/'+climofile1,decode_times=False)
-        data2=xr.open_dataset(climoDir+'/'+climofile2,decode_times=False)
-        data1=data1['surf_el'].copy().squeeze()
-        data2=data2['surf_el'].copy().squeeze()                    
+        data1=read_month(start.month)
+        data2=read_month(stop.month)
         #data=data1*left+data2*right
         data=data1+((data2-data1)*left)
-        climofile='weighted average of '+climofile1+' and '+climofile2
-    return data
+    return xr.DataArray(data,dims='locations',name='surf_el',attrs=climo['attrs'],
+                        coords={'lon':('locations',obs.longitude.values),
+                                'lat':('locations',obs.latitude.values)})
 #-------------------------------------------------
-def get_regridder(model,obs,vDate,param=None):
-    print('initializing xESMF regridder')
-    weightfile=f'{tempDir}/godae/godae_{obs.obs_type.replace(" ","_")}_{param}_{vDate:%Y%m%d}_weights.nc'
-    xobs=xr.Dataset()
-    xobs.coords['lon']=obs.longitude
-    xobs.coords['lat']=obs.latitude
-    if obs.obs_type != 'AMSR2 brightness temperature':
-        xobs.coords['depth']=obs.depth
-    #xobs['observation']=obs.observation[:,0,:]
-    # rename model coords as needed
-    regridder=xe.Regridder(model,xobs,'bilinear',
-                           filename=weightfile,
-                           ignore_degenerate=True,
-                           locstream_out=True)
-    return regridder
+def lonlat2xyz(lon,lat):
+    """
+    unit vectors on the sphere
+    """
+    lon=np.deg2rad(np.asarray(lon,dtype=np.float64))
+    lat=np.deg2rad(np.asarray(lat,dtype=np.float64))
+    return np.stack([np.cos(lat)*np.cos(lon),np.cos(lat)*np.sin(lon),np.sin(lat)],axis=-1)
 #-------------------------------------------------
-def depth_interp(model,obs):
+def get_grid_index(model):
     """
-    this routine expects a DataArray
+    KD-tree over the RTOFS grid points, built once and kept on disk under
+    tempDir/godae.  The grid is the same for every param and date, so the
+    saved index is only rebuilt if the lon/lat no longer match it.
     """
-    
-    tall=np.array([])
-    for nob in obs.numobs:        
-        tnew=np.array([])
-        snew=np.array([])
-        for nt in range(model.MT.size):
-            model2=model.isel(MT=nt).copy()
-            obs_depth=obs.depth[nob].values
-            ft=sip.interp1d(model2.Depth.values,model2[:,nob].values,bounds_error=False)
-            if tnew.size==0: 
-                tnew=ft(obs.depth[nob].values)
-            else:
-                tnew=np.vstack((tnew,ft(obs.depth[nob].values)))
-                
-        if tall.size==0:
-            tall=tnew
-        else:
-            tall=np.dstack((tall,tnew))
-
-    tall=tall.swapaxes(2,1)
+    global _grid_index
+    lon=np.ascontiguousarray(model.lon.values)
+    lat=np.ascontiguousarray(model.lat.values)
+    checksum=hashlib.sha1(lon.tobytes()+lat.tobytes()).hexdigest()
+    with _grid_lock:
+        if _grid_index is None or _grid_index['checksum']!=checksum:
+            _grid_index=load_grid_index(lon,lat,checksum)
+        return _grid_index
+#-------------------------------------------------
+def load_grid_index(lon,lat,checksum):
+    """
+    read the saved grid index, or build and save a new one
+    """
+    indexfile=f'{tempDir}/godae/rtofs_grid_index.pkl'
+    if os.path.exists(indexfile):
+        with open(indexfile,'rb') as f:
+            index=pickle.load(f)
+        if index['checksum']==checksum:
+            return index
+    print('building RTOFS grid index')
+    index={'checksum':checksum,
+           'shape':lon.shape,
+           'tree':spatial.cKDTree(lonlat2xyz(lon,lat).reshape(-1,3))}
+    os.makedirs(os.path.dirname(indexfile),exist_ok=True)
+    tmpfile=f'{indexfile}.{os.getpid()}'
+    with open(tmpfile,'wb') as f:
+        pickle.dump(index,f,protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpfile,indexfile)
+    return index
+#-------------------------------------------------
+def bilinear_cells(xyz,point,j,i):
+    """
+    Try the cells with lower-left corner (j,i) for each point.  Corners 
+    are projected onto the plane tangent at the point (gnomonic), and the 
+    bilinear map is inverted there by Newton iteration.
+    Returns the cell coordinates (s,t), NaN where the inversion fails.
+    """
+    ny,nx=xyz.shape[:2]
+    i1=(i+1)%nx  # periodic in X
+    corners=np.stack([xyz[j,i],xyz[j,i1],xyz[j+1,i1],xyz[j+1,i]])
+    # local east/north basis at each point
+    east=np.stack([-point[:,1],point[:,0],np.zeros(len(point))],axis=-1)
+    east/=np.linalg.norm(east,axis=-1,keepdims=True)
+    north=np.cross(point,east)
+    with np.errstate(all='ignore'):
+        q=corners/np.einsum('kpc,pc->kp',corners,point)[...,np.newaxis]
+        px=np.einsum('kpc,pc->kp',q,east)
+        py=np.einsum('kpc,pc->kp',q,north)
+        ex,ey=px[1]-px[0],py[1]-py[0]
+        fx,fy=px[3]-px[0],py[3]-py[0]
+        gx,gy=px[0]-px[1]+px[2]-px[3],py[0]-py[1]+py[2]-py[3]
+        s=np.full(len(point),0.5)
+        t=np.full(len(point),0.5)
+        for it in range(10):
+            rx=px[0]+s*ex+t*fx+s*t*gx
+            ry=py[0]+s*ey+t*fy+s*t*gy
+            j00,j01=ex+t*gx,fx+s*gx
+            j10,j11=ey+t*gy,fy+s*gy
+            det=j00*j11-j01*j10
+            s=s-(j11*rx-j01*ry)/det
+            t=t-(j00*ry-j10*rx)/det
+    return s,t
+#-------------------------------------------------
+def get_stencil(model,obs,vDate=None,param=None):
+    """
+    Bilinear stencils for the GODAE locations on the RTOFS tripolar grid.
+    Only the RTOFS lon/lat are read here, the grid has the old lon fix 
+    applied so the tripole seam is handled as before.
+    Returns the sparse weights (numobs x cells) and the (Y,X) grid indices
+    of the cells they use.
+    """
+    index=get_grid_index(model)
+    ny,nx=index['shape']
+    xyz=index['tree'].data.reshape(ny,nx,3)
+    point=lonlat2xyz(obs.longitude.values,obs.latitude.values)
+    nobs=len(point)
+    cell=np.full((nobs,2),-1)
+    st=np.zeros((nobs,2))
+    # the containing cell shares a corner with one of the nearest nodes
+    for k in (1,4):
+        todo=np.flatnonzero(cell[:,0]<0)
+        if todo.size==0:
+            break
+        nodes=index['tree'].query(point[todo],k=k)[1].reshape(todo.size,-1)
+        for node in nodes.T:
+            for dj,di in ((0,0),(0,-1),(-1,0),(-1,-1)):
+                left=cell[todo,0]<0
+                if not left.any():
+                    break
+                p=todo[left]
+                j=node[left]//nx+dj
+                i=(node[left]%nx+di)%nx
+                ok=(j>=0)&(j<ny-1)
+                s=np.full(p.size,np.nan)
+                t=np.full(p.size,np.nan)
+                s[ok],t[ok]=bilinear_cells(xyz,point[p[ok]],j[ok],i[ok])
+                eps=1.e-6
+                found=(s>=-eps)&(s<=1+eps)&(t>=-eps)&(t<=1+eps)
+                cell[p[found]]=np.stack([j[found],i[found]],axis=-1)
+                st[p[found]]=np.stack([s[found],t[found]],axis=-1).clip(0,1)
+    # unmapped points get no weights, as with xESMF
+    found=np.flatnonzero(cell[:,0]>=0)
+    if found.size<nobs:
+        print(f'{nobs-found.size} GODAE locations not mapped to the RTOFS grid')
+    j,i=cell[found].T
+    s,t=st[found].T
+    stencil=make_stencil(nobs,found,j,i,s,t,(ny,nx))
+    print(f'bilinear stencil uses {stencil["cells"].size} of {ny*nx} model columns')
+    return stencil
+#-------------------------------------------------
+def make_stencil(nobs,found,j,i,s,t,shape):
+    """
+    Sparse bilinear weights (nobs x cells) for the points found in the 
+    cells with lower-left corner (j,i) at cell coordinates (s,t), periodic
+    in X.  Rows of the points not found are left empty.
+    """
+    ny,nx=shape
+    i1=(i+1)%nx
+    flat=np.concatenate([j*nx+i,j*nx+i1,(j+1)*nx+i1,(j+1)*nx+i])
+    wts=np.concatenate([(1-s)*(1-t),s*(1-t),s*t,(1-s)*t])
+    rows=np.tile(found,4)
+    cells,cols=np.unique(flat,return_inverse=True)
+    weights=sparse.csr_matrix((wts,(rows,cols)),shape=(nobs,cells.size))
+    weights.eliminate_zeros()
+    return {'weights':weights,
+            'cells':cells,
+            'iy':cells//nx,
+            'ix':cells%nx,
+            'shape':shape}
+#-------------------------------------------------
+def union_columns(stencils):
+    """
+    All the model columns used by a list of stencils
+    """
+    ny,nx=stencils[0]['shape']
+    cells=np.unique(np.concatenate([s['cells'] for s in stencils]))
+    return {'cells':cells,
+            'iy':cells//nx,
+            'ix':cells%nx,
+            'shape':(ny,nx)}
+#-------------------------------------------------
+def get_columns(data,stencil):
+    """
+    Subset a lazy RTOFS dataset to the stencil columns.  Only the dask
+    chunks holding those columns are read when the result is loaded.
+    """
+    iy=xr.DataArray(stencil['iy'],dims='cell')
+    ix=xr.DataArray(stencil['ix'],dims='cell')
+    return data.isel(Y=iy,X=ix)
+#-------------------------------------------------
+def stencil_mean(values1,values2,weights):
+    """
+    Average the column arrays of two instants, {var: (..., cell)}, and
+    apply the bilinear weights, same layout as the xESMF locstream output
+    (..., locations).  Arrays in and out, so it runs on any dask backend.
+    """
+    out={}
+    for key in values1:
+        mean=(values1[key]+values2[key])/2.
+        values=mean.reshape(-1,mean.shape[-1])
+        out[key]=(weights @ values.T).T.reshape(mean.shape[:-1]+(weights.shape[0],))
+    return out
+#-------------------------------------------------
+def depth_index(model_depth,obs_depth):
+    """
+    Precompute the model level bracketing each obs depth.  Shared by T and S.
+    Follows scipy interp1d(kind='linear',bounds_error=False) so the batched
+    result matches the old per-profile loop exactly.
+    """
+    x=np.asarray(model_depth)
+    xnew=np.asarray(obs_depth)
+    hi=np.searchsorted(x,xnew).clip(1,x.size-1)
+    lo=hi-1
+    index={'lo':lo,
+           'hi':hi,
+           'dx':xnew-x[lo],
+           'width':x[hi]-x[lo],
+           'outside':(xnew<x[0])|(xnew>x[-1]),
+           'knot':x[hi]==xnew,
+           'np_interp':x.dtype in (np.dtype(np.float64),np.dtype(int))}
+    return index
+#-------------------------------------------------
+def depth_interp(model,obs,index=None):
+    """
+    this routine expects a DataArray or Variable (MT, Depth, numobs) and
+    returns an array of (MT, numobs, numdeps), obs is only used without
+    index.  All profiles and forecast times 
+    are interpolated at once.  Model levels below the seafloor are NaN 
+    and give NaN at any obs depth bracketed by them.
+    """
+    if index is None:
+        index=depth_index(model.Depth.values,obs.depth.values)
+    y=np.asarray(model.values)
+    nobs=np.arange(y.shape[-1])[:,np.newaxis]
+    y_lo=y[:,index['lo'],nobs]
+    y_hi=y[:,index['hi'],nobs]
+    slope=(y_hi-y_lo)/index['width']
+    tall=slope*index['dx']+y_lo
+    # interp1d hands float64 data to np.interp, which returns knots exactly
+    if index['np_interp'] and y.dtype in (np.dtype(np.float64),np.dtype(int)):
+        tall=np.where(index['knot'],y_hi,tall)
+    tall[:,index['outside']]=np.nan
     return tall
 #----------------------------------------------------------------
-def create_profile_dataset(model,persist,best_estimate,obs):
+def create_dataset(param,model,persist,best_estimate,obs,climo=None):
     """
+    Load the model values into a new class4 dataset, laid out by 
+    class4_layout.
+    
     Important to remember
     model and persist times are 24hr fcst onward, or [1:7] in forecast array.  
     Skip the 0 hour fcst, even for persist.  0Z persist is best_estimate.
-    """
-    
-    # begin with the depth interpolation
-    fcst_t=depth_interp(model.temperature,obs)
-    fcst_s=depth_interp(model.salinity,obs)
-    
-    persist_t=depth_interp(persist.temperature,obs)
-    persist_s=depth_interp(persist.salinity,obs)
+    Ice keeps all 9 leads from the 0 hour fcst.
     
-    best_estimate_t=depth_interp(best_estimate.temperature,obs)
-    best_estimate_s=depth_interp(best_estimate.salinity,obs)
+    The obs variables are shared with obs, not copied.  forecast, 
+    persistence and best_estimate are allocated once and filled in place,
+    persistence and best_estimate are sometimes missing from the obs 
+    dataset and are then shaped like forecast and climatology.
+    """
+    layout=class4_layout[param]
+    keys=layout['vars']
+    leads,fcsts=layout['leads'],layout['fcsts']
 
-    # copy the obs dataset and load it with model values
-    # this assumes that forecast is present, but makes no
-    # assumptions about persistence or best_estimate, which
-    # is sometimes missing from obs dataset
-    obs2=obs.copy(deep=True)    
-        
-    # null out the fields first
-    obs2['forecast']=obs2['forecast']*np.nan
-    if 'persistence' not in obs2:
-        obs2['persistence']=xr.ones_like(obs2.forecast)*np.nan
-    else:
-        obs2['persistence']=obs2['persistence']*np.nan
-    if 'best_estimate' not in obs2:
-        obs2['best_estimate']=xr.ones_like(obs.climatology)*np.nan
+    # model values at the obs depths (MT, numobs, numdeps) for each var
+    if param=='profile':
+        # levels are the same for every pass and the six passes run as
+        # parallel dask tasks, on the arrays only
+        index=depth_index(model.Depth.values,obs.depth.values)
+        interp=dask.delayed(depth_interp)
+        values=dask.compute([[interp(data[key].variable,None,index) for key in keys] 
+                             for data in (model,persist,best_estimate)])[0]
     else:
-        obs2['best_estimate']=obs2['best_estimate']*np.nan
+        values=[[data[key].values[...,np.newaxis] for key in keys] 
+                for data in (model,persist,best_estimate)]
+    model_values,persist_values,best_values=values
 
-    obs2['forecast'][:,0,]=fcst_t[1:7,].swapaxes(0,1)
-    obs2['forecast'][:,1,]=fcst_s[1:7,].swapaxes(0,1)    
-    obs2['persistence'][:,0,]=persist_t[1:7,].swapaxes(0,1)
-    obs2['persistence'][:,1,]=persist_s[1:7,].swapaxes(0,1)
-    obs2['best_estimate'][:,0,]=best_estimate_t.squeeze()
-    obs2['best_estimate'][:,1,]=best_estimate_s.squeeze()
+    def allocate(template,comment):
+        data=np.full(template.shape,np.nan,dtype=np.result_type(template.dtype,np.nan))
+        return xr.Variable(template.dims,data,{'comment':comment})
 
-    # add comments to the metadata
-    obs2['forecast'].attrs['comment']='12Z time average of 00Z model forecast and forecast+24h daily instantaneous fields'
-    obs2['persistence'].attrs['comment']='12Z time average of 00Z model nowcast and nowcast+24h daily instantaneous fields'
-    obs2['best_estimate'].attrs['comment']='12Z time average of 00Z model nowcast and nowcast+24h daily instantaneous fields'
+    forecast=allocate(obs.forecast,fcst_comment)
+    persistence=allocate(obs.get('persistence',obs.forecast),nowcast_comment)
+    best=allocate(obs.get('best_estimate',obs.climatology),nowcast_comment)
+    for k in range(len(keys)):
+        forecast.data[:,k,fcsts]=model_values[k][leads].swapaxes(0,1)
+        persistence.data[:,k,fcsts]=persist_values[k][leads].swapaxes(0,1)
+        best.data[:,k]=best_values[k][0]
 
-    # add times
-    obs2['modeljuld']=obs.modeljuld.to_series()
-    obs2['leadtime'][:]=model.forecast[1:7]
-    
-    return obs2
-#----------------------------------------------------------------
-def create_SST_dataset(model,persist,best_estimate,obs):
-
-    obs2=obs.copy(deep=True)
-    
-    # null out the fields first
-    obs2['forecast']=obs2['forecast']*np.nan
-    if 'persistence' not in obs2:
-        obs2['persistence']=xr.ones_like(obs2.forecast)*np.nan
-    else:
-        obs2['persistence']=obs2['persistence']*np.nan
-    if 'best_estimate' not in obs2:
-        obs2['best_estimate']=xr.ones_like(obs.climatology)*np.nan
-    else:
-        obs2['best_estimate']=obs2['best_estimate']*np.nan
-    
-    obs2['forecast'][:]=model.sst[1:7,].values.swapaxes(0,1)[:,np.newaxis,:,np.newaxis]
-    obs2['persistence'][:]=persist.sst[1:7,].values.swapaxes(0,1)[:,np.newaxis,:,np.newaxis]
-    obs2['best_estimate'][:]=best_estimate.sst.values.swapaxes(0,1)[:,:,np.newaxis]
+    obs2=obs.copy(deep=False)
+    obs2['forecast']=forecast
+    obs2['persistence']=persistence
+    obs2['best_estimate']=best
+    if climo is not None:
+        mdt=np.empty(obs.mdt_reference.shape,obs.mdt_reference.dtype)
+        mdt[:]=climo.values[:,np.newaxis,np.newaxis]
+        mdt=obs.mdt_reference.variable.copy(deep=False,data=mdt)
+        mdt.attrs['comment']='HYCOM 30-yr monthly mean SSH interpolated to the correct day'
+        obs2['mdt_reference']=mdt
 
     # add times
-    obs2['modeljuld']=obs.modeljuld.to_series()
-    obs2['leadtime'][:]=model.forecast[1:7]
-    
-    # add comments to the metadata
-    obs2['forecast'].attrs['comment']='12Z time average of 00Z model forecast and forecast+24h daily instantaneous fields'
-    obs2['persistence'].attrs['comment']='12Z time average of 00Z model nowcast and nowcast+24h daily instantaneous fields'
-    obs2['best_estimate'].attrs['comment']='12Z time average of 00Z model nowcast and nowcast+24h daily instantaneous fields'
-    
-    return obs2
-#----------------------------------------------------------------
-def create_SLA_dataset(model,persist,best_estimate,climo,obs):
+    if layout['times']:
+        obs2['modeljuld']=obs.modeljuld.to_series()
+        leadtime=np.asarray(model.forecast.values[leads],dtype=obs.leadtime.dtype)
+        obs2['leadtime']=obs.leadtime.variable.copy(deep=False,data=leadtime)
     
-    obs2=obs.copy(deep=True)
-        
-    # null out the fields first
-    obs2['forecast']=obs2['forecast']*np.nan
-    if 'persistence' not in obs2:
-        obs2['persistence']=xr.ones_like(obs2.forecast)*np.nan
-    else:
-        obs2['persistence']=obs2['persistence']*np.nan
-    if 'best_estimate' not in obs2:
-        obs2['best_estimate']=xr.ones_like(obs.climatology)*np.nan
-    else:
-        obs2['best_estimate']=obs2['best_estimate']*np.nan
-        
-    obs2['forecast'][:]=model.sla[1:7,].values.swapaxes(0,1)[:,np.newaxis,:,np.newaxis]
-    obs2['persistence'][:]=persist.sla[1:7,].values.swapaxes(0,1)[:,np.newaxis,:,np.newaxis]
-    obs2['best_estimate'][:]=best_estimate.sla.values.swapaxes(0,1)[:,:,np.newaxis]
-    obs2['mdt_reference'][:]=climo.values[:,np.newaxis,np.newaxis]
-
-    # add times
-    obs2['modeljuld']=obs.modeljuld.to_series()
-    obs2['leadtime'][:]=model.forecast[1:7]
-
-    # add comments to metadata
-    obs2['forecast'].attrs['comment']='12Z time average of 00Z model forecast and forecast+24h daily instantaneous fields'
-    obs2['persistence'].attrs['comment']='12Z time average of 00Z model nowcast and nowcast+24h daily instantaneous fields'
-    obs2['best_estimate'].attrs['comment']='12Z time average of 00Z model nowcast and nowcast+24h daily instantaneous fields'
-    obs2['mdt_reference'].attrs['comment']='HYCOM 30-yr monthly mean SSH interpolated to the correct day'
-
     return obs2
 #----------------------------------------------------------------
-def create_ice_dataset(model,persist,best_estimate,obs):
-    
-    obs2=obs.copy(deep=True)
-        
-    # null out the fields first
-    obs2['forecast']=obs2['forecast']*np.nan
-    if 'persistence' not in obs2:
-        obs2['persistence']=xr.ones_like(obs2.forecast)*np.nan
-    else:
-        obs2['persistence']=obs2['persistence']*np.nan
-    if 'best_estimate' not in obs2:
-        obs2['best_estimate']=xr.ones_like(obs.climatology)*np.nan
-    else:
-        obs2['best_estimate']=obs2['best_estimate']*np.nan
-        
-    obs2['forecast'][:,:,0:9,]=model.ice.values.swapaxes(0,1)[:,np.newaxis,:,np.newaxis]
-    obs2['persistence'][:,:,0:9,]=persist.ice.values.swapaxes(0,1)[:,np.newaxis,:,np.newaxis]
-    obs2['best_estimate'][:]=best_estimate.ice.values.swapaxes(0,1)[:,:,np.newaxis]
-    
-    # add times
-    #obs2['modeljuld']=obs.modeljuld.to_series()
-    #obs2['leadtime'][:]=model.forecast[1:7]
-    
-    # add comments to metadata
-    obs2['forecast'].attrs['comment']='12Z time average of 00Z model forecast and forecast+24h daily instantaneous fields'
-    if 'persistence' not in obs2:
-        obs2['persistence']=xr.ones_like(obs2.forecast)*np.nan    
-    obs2['persistence'].attrs['comment']='12Z time average of 00Z model nowcast and nowcast+24h daily instantaneous fields'
-    if 'best_estimate' not in obs2:
-        obs2['best_estimate']=xr.ones_like(obs.climatology)*np.nan
-    obs2['best_estimate'].attrs['comment']='12Z time average of 00Z model nowcast and nowcast+24h daily instantaneous fields'
-    
-    return obs2
-# main routine starts here                                       
-if __name__ == '__main__':
-    
-    theDate=pd.Timestamp(sys.argv[1])
-    param=sys.argv[2]  # profile, SST, SLA, aice
-    
-    obs=get_godae(theDate,param)
-    
-    # if file not found, exit immediately
-    if obs is None:
-        print('Exiting now')
-        sys.exit(0)
-        
-    data_keys={'profile':['temperature','salinity'],
-               'aice':['ice'],
-               'SLA':['ssh'],
-               'SST':['sst']}
-
-    # get rtofs forecast data from today and tomorrow (for 12Z mean)
-    model1=get_rtofs(theDate,obs,wantPersist=False)
-    model2=get_rtofs(theDate+timedelta(1),obs,wantPersist=False)
-    
-    model1=model1.reset_index('MT')
-    model2=model2.reset_index('MT')    
-    model=xr.full_like(model1,fill_value=np.nan)
-    for key in data_keys[param]:
-        model[key]=(model1[key]+model2[key])/2.
-    model['MT_']=model.MT_.to_pandas()+pd.Timedelta('0.5d')        
-    model=model.set_index({'MT':'MT_'})
-    del model1, model2    
+def process_date(theDate,param,obs,model_stencil,cache=None,columns=None,report=None):
+    """
+    Interpolate RTOFS forecast, persistence and best estimate to the GODAE
+    locations for one date and return the new class-4 dataset.
+    cache and columns are shared between dates in range mode.  The stage 
+    timings and the RTOFS files read go to report.
+    """
+    if cache is None:
+        cache={}
+    cached=set(cache)
         
-    # regrid model to GODAE
-    model.load()
-    model_regridder=get_regridder(model,obs,theDate,'model')
-    model=model_regridder(model,keep_attrs=True)
+    # 12Z mean of rtofs forecast data from today and tomorrow, sampled to
+    # GODAE lead by lead.  Only the model columns under the bilinear 
+    # stencil are read, and each file only once
+    with timed(report,'rtofs_forecast'):
+        model=get_rtofs_mean(theDate,obs,model_stencil,False,cache,columns)
     
+    climo=None
     if param=='SLA':
-        climo=get_hycom_climo(theDate,model)    
-        climo.load()
-        climo_regridder=get_regridder(climo,obs,theDate,'climo')
-        climo=climo_regridder(climo,keep_attrs=True)  # need climo regridded for SLA calc
+        with timed(report,'climo'):
+            climo=get_hycom_climo(theDate,obs)  # MDT at the GODAE locations for SLA calc
         model['sla']=model.ssh-climo
         del model['ssh']
             
-    # get rtofs nowcast data from today and tomorrow (for 12Z mean)
-    persist1=get_rtofs(theDate,obs,wantPersist=True)
-    persist2=get_rtofs(theDate+timedelta(1),obs,wantPersist=True)
-    
-    persist1=persist1.reset_index('MT')
-    persist2=persist2.reset_index('MT')    
-    persist=xr.full_like(persist1,fill_value=np.nan)
-    for key in data_keys[param]:
-        persist[key]=(persist1[key]+persist2[key])/2.
-    persist['MT_']=persist.MT_.to_pandas()+pd.Timedelta('0.5d')
-    persist=persist.set_index({'MT':'MT_'})
-    del persist1, persist2
+    # 12Z mean of rtofs nowcast data from today and tomorrow, at GODAE
+    with timed(report,'rtofs_persist'):
+        persist=get_rtofs_mean(theDate,obs,model_stencil,True,cache,columns)
+    if report is not None:
+        report['rtofs_reads']+=[cache[key].encoding['read'] for key in cache if key not in cached]
 
-    # best estimate is avg of today and tomorrow's nowcast
-    best_estimate=persist.isel({'MT':[0]}) 
-    
-    # regrid model persistence to GODAE
-    persist.load()    
-    persist=model_regridder(persist,keep_attrs=True)
-
-    # regrid model best_estimate to GODAE
-    best_estimate.load()
-    best_estimate=model_regridder(best_estimate,keep_attrs=True)
-    
     if param=='SLA':
         persist['sla']=persist.ssh-climo
-        best_estimate['sla']=best_estimate.ssh-climo
-        del persist['ssh'], best_estimate['ssh']
+        del persist['ssh']
+
+    # best estimate is avg of today and tomorrow's nowcast, already regridded
+    best_estimate=persist.isel({'MT':[0]}) 
                              
     # substitute model data into obs dataset 
-    if param=='profile':
-        obs2=create_profile_dataset(model,persist,best_estimate,obs)
-    elif param=='SST':
-        obs2=create_SST_dataset(model,persist,best_estimate,obs)
-    elif param=='SLA':
-       obs2=create_SLA_dataset(model,persist,best_estimate,climo,obs)
-    elif param=='aice':
-       obs2=create_ice_dataset(model,persist,best_estimate,obs)
-    else:
+    if param not in class4_layout:
         print('Unrecognized parameter.  Exiting')
-
-    # cleanup - not available with xesmf 0.6.0
-    #model_regridder.clean_weight_file()
-    #if param=='SLA':
-    #    climo_regridder.clean_weight_file()
-
-    version=2.0
+        return None
+    with timed(report,'assembly'):
+        obs2=create_dataset(param,model,persist,best_estimate,obs,climo)
+    
+    return obs2
+#----------------------------------------------------------------
+def write_product(obs2,theDate,param,report=None):
+    """
+    Write the class-4 file for GODAE, then compress and encrypt it
+    """
+    version=product_version
         
     # write out in netcdf-3 (classic) format
     obs2.attrs['creation_date']=f'{datetime.now()} UTC'
@@ -521,21 +918,564 @@ if __name__ == '__main__':
     if 'suite' in obs2.attrs:
         del obs2.attrs['suite'], obs2.attrs['suite_number']
 
-    ncfile=f'{godaeDir}/outgoing/class4_{theDate:%Y%m%d}_HYCOM_RTOFS_{version}_{param}.nc'
+    ncfile=product_file(theDate,param)
         
-    encoding={key:{'zlib':True} for key in obs2.keys()}
-    # juld and modeljuld need new units
+    # juld and modeljuld need new units, netcdf-3 has no compression so
+    # nothing else is set and any backend can write the buffer
     if param != 'aice':
-        encoding['juld']['units']='Days since 1950-01-01 00:00:00 UTC'
-        encoding['modeljuld']['units']='Days since 1950-01-01 00:00:00 UTC'
+        encoding={'juld':{'units':'Days since 1950-01-01 00:00:00 UTC'},
+                  'modeljuld':{'units':'Days since 1950-01-01 00:00:00 UTC'}}
     else:
-        encoding['obs_time']['units']='Days since 1950-01-01 00:00:00 UTC'
+        encoding={'obs_time':{'units':'Days since 1950-01-01 00:00:00 UTC'}}
+    
+    # serialize once, the nc file and the upload file are both written
+    # from the same buffer
+    with timed(report,'write'):
+        data=obs2.to_netcdf(None,format='NETCDF3_CLASSIC',encoding=encoding)
+        with open(ncfile,'wb') as f:
+            f.write(data)
+    
+    # compress and encrypt in preparation for upload, same as
+    #   gzip -c ncfile | openssl enc -e -aes-256-cbc -salt -pass pass:<passwd>
+    with timed(report,'encrypt'):
+        encrypt_stream(gzip_blocks(data),f'{ncfile}.gz.enc')
+    if report is not None:
+        report['product_bytes']=len(data)
+    return ncfile
+#----------------------------------------------------------------
+def class4_stats(obs2,theDate,param):
+    """
+    Running sums of model against obs for one class-4 product, taken from
+    the assembled dataset while it is in memory.  count and the
+    stats_moments sums are kept by obs type, source (forecast,
+    persistence, best_estimate, climatology), region, lead hours,
+    variable and depth bin.  best_estimate and climatology are at lead 0.
+    Aggregates of any number of products add up, see class4_stats.py.
+    Obs flagged by qc, if there is one, are left out.
+    """
+    layout=class4_layout[param]
+    keys=layout['vars']
+    leads=rtofs_fcsts[layout['leads']].astype(float)
+    fcsts=np.arange(obs2.sizes['numfcsts'])[layout['fcsts']][:len(leads)]
+    lead_axis=np.union1d([0.],leads)
+
+    observation=obs2.observation.values.astype(float)  # (numobs, numvars, numdeps)
+    valid=np.isfinite(observation)
+    if 'qc' in obs2:
+        valid&=obs2.qc.values==0
+    if param=='profile':
+        bins=profile_depths
+        depth_bin=np.digitize(obs2.depth.values,bins,right=True)
+        valid&=(depth_bin<len(bins))[:,np.newaxis,:]
+        depth_bin=np.minimum(depth_bin,len(bins)-1)
+    else:
+        bins=[0.]
+        depth_bin=np.zeros(obs2.depth.shape,int)
+
+    lon=(obs2.longitude.values+180)%360-180
+    lat=obs2.latitude.values
+    sources={'forecast':(obs2.forecast.values[:,:,fcsts],leads),
+             'persistence':(obs2.persistence.values[:,:,fcsts],leads),
+             'best_estimate':(obs2.best_estimate.values[:,:,np.newaxis],[0.]),
+             'climatology':(obs2.climatology.values[:,:,np.newaxis],[0.])}
+    shape=(len(lead_axis),len(keys),len(bins))
+    count=np.zeros((len(sources),len(stats_regions))+shape,np.int64)
+    sums=np.zeros((len(stats_moments),)+count.shape)
+    for n,(model,model_leads) in enumerate(sources.values()):
+        # flat (lead, variable, depth bin) group of every value
+        li=np.searchsorted(lead_axis,model_leads)
+        vi=np.arange(len(keys))
+        group=((li[np.newaxis,np.newaxis,:,np.newaxis]*len(keys)+vi[np.newaxis,:,np.newaxis,np.newaxis])*len(bins)
+               +depth_bin[:,np.newaxis,np.newaxis,:])
+        model=model.astype(float)
+        obs=np.broadcast_to(observation[:,:,np.newaxis],model.shape)
+        error=model-obs
+        moments=[error,error**2,np.abs(error),obs,obs**2,model,model**2,obs*model]
+        good=valid[:,:,np.newaxis]&np.isfinite(model)
+        where=np.nonzero(good)[0]  # obs of each good value
+        group=np.broadcast_to(group,good.shape)[good]
+        moments=[values[good] for values in moments]
+        for r,(south,north,west,east) in enumerate(stats_regions.values()):
+            inside=(lat>=south)&(lat<=north)
+            if west<=east:
+                inside&=(lon>=west)&(lon<=east)
+            else:
+                inside&=(lon>=west)|(lon<=east)
+            mask=inside[where]
+            g=group[mask]
+            count[n,r]=np.bincount(g,minlength=np.prod(shape)).reshape(shape)
+            for m,values in enumerate(moments):
+                sums[m,n,r]=np.bincount(g,weights=values[mask],minlength=np.prod(shape)).reshape(shape)
+
+    dims=('obs_type','source','region','lead','variable','depth_bin')
+    stats=xr.Dataset(coords={'obs_type':[obs2.attrs.get('obs_type',obs_types[param])],
+                             'source':list(sources),
+                             'region':list(stats_regions),
+                             'lead':('lead',lead_axis,{'units':'hours'}),
+                             'variable':keys,
+                             'depth_bin':('depth_bin',np.asarray(bins),
+                                          {'units':'m','comment':'upper edge, the bin starts at the previous edge'})})
+    stats['count']=(dims,count[np.newaxis])
+    for m,name in enumerate(stats_moments):
+        stats[name]=(dims,sums[m][np.newaxis])
+    stats.attrs={'start_date':f'{theDate:%Y%m%d}','end_date':f'{theDate:%Y%m%d}',
+                 'comment':'model minus obs running sums, see class4_stats.py'}
+    return stats
+#----------------------------------------------------------------
+def stats_file(theDate,param):
+    """
+    the class-4 statistics of one product
+    """
+    return f'{godaeDir}/stats/{theDate:%Y}/class4_{theDate:%Y%m%d}_HYCOM_RTOFS_{product_version}_{param}.stats.nc'
+#----------------------------------------------------------------
+def write_stats(stats,theDate,param):
+    """
+    save the statistics of one product, see class4_stats
+    """
+    fname=stats_file(theDate,param)
+    os.makedirs(os.path.dirname(fname),exist_ok=True)
+    encoding={key:{'zlib':True} for key in stats.data_vars}
+    stats.to_netcdf(f'{fname}.tmp',encoding=encoding)
+    os.replace(f'{fname}.tmp',fname)
+    return fname
+#----------------------------------------------------------------
+def product_file(theDate,param):
+    """
+    the class-4 file written for GODAE
+    """
+    return f'{godaeDir}/outgoing/class4_{theDate:%Y%m%d}_HYCOM_RTOFS_{product_version}_{param}.nc'
+#----------------------------------------------------------------
+def open_product(theDate,param):
+    """
+    Open a product that was already written.  The plain .nc is read when it
+    is still there, otherwise the .nc.gz.enc is decrypted in memory.
+    """
+    ncfile=product_file(theDate,param)
+    if os.path.exists(ncfile):
+        return xr.open_dataset(ncfile)
+    return open_godae(gunzip(decrypt_blocks(f'{ncfile}.gz.enc')))
+#----------------------------------------------------------------
+def gzip_blocks(data,blocksize=None,workers=None):
+    """
+    gzip the buffer as independent gzip members, compressed in parallel.
+    The members are yielded in order, together they are one gzip stream
+    (gzip -d, zcat).
+    """
+    blocksize=blocksize or gzipBlock
+    view=memoryview(data).cast('B')
+    blocks=[view[n:n+blocksize] for n in range(0,len(view),blocksize)] or [view]
+    def compress(block):
+        z=zlib.compressobj(6,zlib.DEFLATED,31)  # 31: gzip header, gzip -6
+        return z.compress(block)+z.flush()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or gzipWorkers) as executor:
+        yield from executor.map(compress,blocks)
+#----------------------------------------------------------------
+def evp_bytes_to_key(password,salt,digest):
+    """
+    openssl enc key and IV from the password and salt (EVP_BytesToKey)
+    """
+    key=b''
+    block=b''
+    while len(key)<48:
+        block=hashlib.new(digest,block+password+salt).digest()
+        key+=block
+    return key[:32],key[32:48]
+#----------------------------------------------------------------
+def decrypt_blocks(encfile,password=None,digest=None,blocksize=None):
+    """
+    Decrypt a salted openssl enc AES-256-CBC file, the same as
+        openssl enc -d -aes-256-cbc -md <digest> -pass pass:<password>
+    and yield the plain blocks.  Uses the cryptography package when it is
+    installed, otherwise reads the output of openssl.  Raises OSError on
+    a bad file, password or digest.
+    """
+    password=password or godae_pass
+    digest=digest or godae_digest
+    blocksize=blocksize or gzipBlock
+    if Cipher is None:
+        proc=subprocess.Popen([openssl,'enc','-d','-aes-256-cbc','-md',digest,
+                               '-pass',f'pass:{password}','-in',encfile],
+                              stdout=subprocess.PIPE)
+        try:
+            for block in iter(lambda: proc.stdout.read(blocksize),b''):
+                yield block
+        finally:
+            proc.stdout.close()
+            status=proc.wait()
+        if status!=0:
+            raise OSError(f'openssl enc -d failed with status {status} for {encfile}')
+        return
+    with open(encfile,'rb') as f:
+        header=f.read(16)
+        if len(header)<16 or header[:8]!=b'Salted__':
+            raise OSError(f'{encfile} is not a salted openssl file')
+        key,iv=evp_bytes_to_key(password.encode(),header[8:],digest)
+        decryptor=Cipher(algorithms.AES(key),modes.CBC(iv)).decryptor()
+        unpadder=padding.PKCS7(128).unpadder()
+        for block in iter(lambda: f.read(blocksize),b''):
+            yield unpadder.update(decryptor.update(block))
+        try:
+            yield unpadder.update(decryptor.finalize())+unpadder.finalize()
+        except ValueError:
+            raise OSError(f'bad decrypt for {encfile}, wrong password or digest')
+#----------------------------------------------------------------
+def gunzip(blocks):
+    """
+    Unzip a gzip stream of one or more members into memory
+    """
+    parts=[]
+    z=zlib.decompressobj(31)
+    started=False
+    try:
+        for block in blocks:
+            while block:
+                parts.append(z.decompress(block))
+                started=True
+                if not z.eof:
+                    break
+                block=z.unused_data  # the next member starts here
+                z=zlib.decompressobj(31)
+                started=False
+    except zlib.error as e:
+        raise OSError(f'bad gzip stream: {e}')
+    if started:
+        raise OSError('truncated gzip stream')
+    return b''.join(parts)
+#----------------------------------------------------------------
+def encrypt_stream(blocks,encfile,password=None,digest=None):
+    """
+    AES-256-CBC encrypt the blocks to encfile in the salted openssl enc
+    format, so it decrypts with
+        openssl enc -d -aes-256-cbc -md <digest> -pass pass:<password>
+    Uses the cryptography package when it is installed, otherwise pipes
+    the blocks through openssl.  The file only appears once it is
+    complete.  Raises OSError if the encryption fails.
+    """
+    password=password or godae_pass
+    digest=digest or godae_digest
+    tmpfile=f'{encfile}.{os.getpid()}.{threading.get_ident()}'
+    try:
+        if Cipher is None:
+            proc=subprocess.Popen([openssl,'enc','-e','-aes-256-cbc','-salt','-md',digest,
+                                   '-pass',f'pass:{password}','-out',tmpfile],
+                                  stdin=subprocess.PIPE)
+            try:
+                for block in blocks:
+                    proc.stdin.write(block)
+            finally:
+                proc.stdin.close()
+                status=proc.wait()
+            if status!=0:
+                raise OSError(f'openssl enc failed with status {status} for {encfile}')
+        else:
+            salt=os.urandom(8)
+            key,iv=evp_bytes_to_key(password.encode(),salt,digest)
+            encryptor=Cipher(algorithms.AES(key),modes.CBC(iv)).encryptor()
+            padder=padding.PKCS7(128).padder()
+            with open(tmpfile,'wb') as f:
+                f.write(b'Salted__'+salt)
+                for block in blocks:
+                    f.write(encryptor.update(padder.update(block)))
+                f.write(encryptor.update(padder.finalize())+encryptor.finalize())
+        os.replace(tmpfile,encfile)
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+#----------------------------------------------------------------
+def run_dates(start,stop,param,profile=False,force=False):
+    """
+    Process every date from start to stop in order in one process.
+    
+    A date uses RTOFS run dates vDate-8 to vDate+1, so consecutive dates
+    share almost all of their files.  The decoded files stay in a sliding 
+    window cache and are evicted once no later date needs them, so each
+    new date only reads the files that are new to the window.  Files are 
+    read for the union of the stencils of every date that will use them,
+    which needs the stencils 9 days ahead.  Only the stencils are kept for
+    those dates, each date's obs are read when it is processed.
+    
+    The class-4 statistics of each product are saved with it, see
+    class4_stats.
+    
+    Each product gets a run report, see write_report.  With profile the
+    processing of each date is also run under cProfile.
+    
+    A product whose manifest still matches its inputs is not made again,
+    unless force is set, see product_inputs.  Missing statistics of such a
+    product are taken from the written file (open_product), a date whose
+    file cannot be read fails.
+    
+    Returns the dates that failed.  Dates without a GODAE file are skipped.
+    """
+    lookahead=9
+    cache={}
+    missing=set()
+    stencils={}
+    reports={}
+    failed=[]
+    dates=pd.date_range(start,stop)
+    manifests={theDate:product_inputs(theDate,param) for theDate in dates}
+    current=set() if force else {theDate for theDate in dates if up_to_date(theDate,param,manifests[theDate])}
+    for theDate in dates:
+        if theDate in current:
+            print(f'{theDate:%Y%m%d} {param} is up to date, skipping')
+            if not os.path.exists(stats_file(theDate,param)):
+                # products made before the statistics were kept
+                try:
+                    with open_product(theDate,param) as obs2:
+                        write_stats(class4_stats(obs2,theDate,param),theDate,param)
+                except (OSError,ValueError) as e:
+                    print(f'Problem with the statistics of {theDate:%Y%m%d} {param}:',e)
+                    failed.append(theDate)
+            continue
+        # only the stencils are kept for the dates ahead, their obs are
+        # read again when they are processed
+        for vDate in pd.date_range(theDate,min(theDate+timedelta(lookahead),stop)):
+            if vDate in reports or vDate in current:
+                continue
+            reports[vDate]=new_report(vDate,param)
+            with timed(reports[vDate],'stencil'):
+                obs=get_godae(vDate,param)
+                if obs is None:
+                    missing.add(vDate)
+                    continue
+                try:
+                    stencils[vDate]=get_stencil(get_grid(vDate,obs),obs)
+                except (OSError,ValueError) as e:
+                    print('Problem opening RTOFS grid for',f'{vDate:%Y%m%d}:',e)
+                obs.close()
+                del obs
+                
+        # a missing GODAE file is not an error, there is nothing to do
+        report=reports.pop(theDate)
+        if theDate in missing:
+            print(f'Skipping {theDate:%Y%m%d} {param}')
+            continue
+        with timed(report,'obs'):
+            obs=get_godae(theDate,param)
+        if obs is None:
+            print(f'Skipping {theDate:%Y%m%d} {param}')
+            stencils.pop(theDate,None)
+            continue
+        report['numobs']=obs.sizes.get('numobs')
+        report['numdeps']=obs.sizes.get('numdeps')
+        if theDate not in stencils:
+            failed.append(theDate)
+            report['status']='failed'
+            write_report(report)
+            continue
+        model_stencil=stencils.pop(theDate)
+        report['mapped']=int((model_stencil['weights'].getnnz(axis=1)>0).sum())
+        columns=union_columns([model_stencil]+list(stencils.values()))
+        profiler=cProfile.Profile() if profile else None
+        try:
+            if profiler is not None:
+                profiler.enable()
+            obs2=process_date(theDate,param,obs,model_stencil,cache,columns,report)
+            if obs2 is None:
+                failed.append(theDate)
+                report['status']='failed'
+            else:
+                print('wrote',write_product(obs2,theDate,param,report))
+                # statistics while the product is still in memory
+                with timed(report,'stats'):
+                    write_stats(class4_stats(obs2,theDate,param),theDate,param)
+                write_manifest(theDate,param,manifests[theDate])
+                report['status']='ok'
+            del obs2
+        except (OSError,ValueError) as e:
+            print(f'Problem processing {theDate:%Y%m%d} {param}:',e)
+            failed.append(theDate)
+            report['status']='failed'
+            report['error']=str(e)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        write_report(report,profiler)
+        obs.close()
+        del obs
+        
+        # evict the files no later date needs (oldest run date is vDate-8)
+        for key in [k for k in cache if k[0] < theDate+timedelta(1)-timedelta(8)]:
+            del cache[key]
+    return failed
+#----------------------------------------------------------------
+def product_inputs(theDate,param):
+    """
+    Manifest of everything a product is made from, the size and mtime of
+    the GODAE class4 file, of the RTOFS files of both days of the 12Z 
+    forecast and persistence means, of the HYCOM climo files for SLA, 
+    and a hash of this script.  Missing files are listed as None.
+    """
+    fn=f'{godaeDir}/incoming/{godae_filename(theDate,param)}'
+    files=[fn if os.path.exists(fn) and not os.path.exists(f'{fn}.gz.enc') else f'{fn}.gz.enc']
+    for vDate in (theDate,theDate+timedelta(1)):
+        for wantPersist in (False,True):
+            files+=[fname for lead in rtofs_leads(vDate,obs_types[param],wantPersist) for fname in lead[3]]
+    if param=='SLA':
+        files+=[climo_file(month) for month in range(1,13)]
+    inputs={}
+    for fname in dict.fromkeys(files):
+        if os.path.exists(fname):
+            stat=os.stat(fname)
+            inputs[fname]=[stat.st_size,int(stat.st_mtime)]
+        else:
+            inputs[fname]=None
+    with open(os.path.abspath(__file__),'rb') as f:
+        code=hashlib.sha1(f.read()).hexdigest()
+    return {'version':product_version,'code':code,'inputs':inputs}
+#----------------------------------------------------------------
+def up_to_date(theDate,param,manifest):
+    """
+    True if the product and its manifest exist, and the manifest matches
+    the current inputs, all of them present
+    """
+    ncfile=product_file(theDate,param)
+    if None in manifest['inputs'].values():
+        return False
+    if not os.path.exists(f'{ncfile}.gz.enc') or not os.path.exists(ncfile.replace('.nc','.manifest.json')):
+        return False
+    with open(ncfile.replace('.nc','.manifest.json')) as f:
+        return json.load(f)==manifest
+#----------------------------------------------------------------
+def write_manifest(theDate,param,manifest):
+    """
+    save the manifest next to the product, class4_..._{param}.manifest.json
+    """
+    with open(product_file(theDate,param).replace('.nc','.manifest.json'),'w') as f:
+        json.dump(manifest,f,indent=1)
+#----------------------------------------------------------------
+def new_report(theDate,param):
+    """
+    run report of one product, filled in stage by stage
+    """
+    return {'date':f'{theDate:%Y%m%d}',
+            'param':param,
+            'host':os.uname().nodename,
+            'pid':os.getpid(),
+            'status':None,
+            'stages':[],
+            'rtofs_reads':[]}
+#----------------------------------------------------------------
+@contextlib.contextmanager
+def timed(report,stage):
+    """
+    Record the wall time of a stage and the peak RSS of the process so
+    far in the run report, if there is one
+    """
+    start=time.perf_counter()
+    try:
+        yield
+    finally:
+        if report is not None:
+            report['stages'].append({'stage':stage,
+                                     'seconds':round(time.perf_counter()-start,4),
+                                     'peak_rss_mb':round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.,1)})
+#----------------------------------------------------------------
+def write_report(report,profiler=None,top=25):
+    """
+    Write the run report as JSON next to the product, 
+    class4_..._{param}.report.json, and print the stage timings.  With a
+    profiler its stats go to class4_..._{param}.prof and the top functions
+    by cumulative time are added to the report.
+    """
+    ncfile=product_file(pd.Timestamp(report['date']),report['param'])
+    reads=report['rtofs_reads']
+    report['rtofs_read_files']=len(reads)
+    report['rtofs_read_bytes']=sum(r['bytes'] for r in reads)
+    report['rtofs_read_seconds']=round(sum(r['seconds'] for r in reads),4)
+    if profiler is not None:
+        profiler.dump_stats(ncfile.replace('.nc','.prof'))
+        stats=pstats.Stats(profiler).stats
+        hot=sorted(stats.items(),key=lambda item: item[1][3],reverse=True)[:top]
+        report['profile']=[{'function':f'{func} ({os.path.basename(fname)}:{line})',
+                            'calls':nc,'tottime':round(tt,4),'cumtime':round(ct,4)}
+                           for (fname,line,func),(cc,nc,tt,ct,callers) in hot]
+    os.makedirs(os.path.dirname(ncfile),exist_ok=True)
+    with open(ncfile.replace('.nc','.report.json'),'w') as f:
+        json.dump(report,f,indent=1)
+    print(f'{report["date"]} {report["param"]} {report["status"]}:',
+          ', '.join(f'{s["stage"]} {s["seconds"]:.1f}s' for s in report['stages']),
+          f'| {report["rtofs_read_files"]} RTOFS files, {report["rtofs_read_bytes"]/2**20:.1f} MB',
+          f'| peak RSS {max([s["peak_rss_mb"] for s in report["stages"]]+[0]):.0f} MB')
+#----------------------------------------------------------------
+def set_scheduler(scheduler='threads',workers=None):
+    """
+    Choose how the dask tasks (file reads, lead averaging and sampling,
+    depth interpolation) are run:
+        synchronous -- one at a time, in the calling thread
+        threads     -- a thread pool in this process
+        processes   -- a local process pool
+        distributed -- a dask.distributed LocalCluster of single-thread workers
+    The RTOFS reads and their cache always stay in threads of this process
+    (read_scheduler), the process and distributed workers only get the
+    column arrays, stencil weights and model profiles to compute on.
+    """
+    if workers is None:
+        workers=int(os.environ.get('SLURM_NTASKS',os.cpu_count()))
+    print(f'dask scheduler: {scheduler}, {workers} workers')
+    if scheduler=='distributed':
+        from dask.distributed import Client, LocalCluster
+        cluster=LocalCluster(n_workers=workers,threads_per_worker=1)
+        return Client(cluster)
+    dask.config.set(scheduler=scheduler,num_workers=workers)
+    return None
+#----------------------------------------------------------------
+def run_params(start,stop,params,workers=4,pool='thread',profile=False,force=False):
+    """
+    Run several params in one process, one worker per param.  Threads 
+    share the RTOFS grid and its index in memory, processes share the saved
+    index on disk.  Each param still writes its own class4 product.
+    cProfile is one per process, so profiled params in a thread pool run
+    one after another.
+    Returns the failed dates for each param.
+    """
+    if len(params)==1 or workers<=1 or (profile and pool=='thread'):
+        return {param:run_dates(start,stop,param,profile,force) for param in params}
+    if pool=='process':
+        executor=concurrent.futures.ProcessPoolExecutor(max_workers=min(workers,len(params)))
+    else:
+        executor=concurrent.futures.ThreadPoolExecutor(max_workers=min(workers,len(params)))
+    with executor:
+        jobs={param:executor.submit(run_dates,start,stop,param,profile,force) for param in params}
+    return {param:job.result() for param,job in jobs.items()}
+# main routine starts here                                       
+if __name__ == '__main__':
     
-    obs2.to_netcdf(ncfile,format='NETCDF3_CLASSIC',encoding=encoding)
+    parser=argparse.ArgumentParser(description='Interpolate Global RTOFS to the GODAE class-4 datasets')
+    parser.add_argument('date',nargs='?',help='valid date YYYYMMDD')
+    parser.add_argument('params',nargs='+',help='one or more of profile, SST, SLA, aice')
+    parser.add_argument('--start',help='first date of a backfill range, YYYYMMDD')
+    parser.add_argument('--stop',help='last date of a backfill range, YYYYMMDD (default: start)')
+    parser.add_argument('--workers',type=int,default=4,help='params run at the same time (default: 4)')
+    parser.add_argument('--pool',choices=['thread','process'],default='thread',help='worker pool type (default: thread)')
+    parser.add_argument('--scheduler',choices=['synchronous','threads','processes','distributed'],
+                        default=os.environ.get('GODAE_SCHEDULER','threads'),
+                        help='dask execution backend (default: $GODAE_SCHEDULER or threads)')
+    parser.add_argument('--dask-workers',type=int,default=os.environ.get('GODAE_DASK_WORKERS'),
+                        help='dask worker count (default: $GODAE_DASK_WORKERS, $SLURM_NTASKS or the cpu count)')
+    parser.add_argument('--profile',action='store_true',
+                        help='run each date under cProfile, stats go next to the run report '
+                             '(dask tasks are only profiled with --scheduler synchronous)')
+    parser.add_argument('--force',action='store_true',help='remake products even if their inputs have not changed')
+    args=parser.parse_args()
+    # with --start the first positional is a param
+    if args.date in data_keys:
+        args.params.insert(0,args.date)
+        args.date=None
     
-    del obs, obs2, model, model_regridder
+    start=args.start or args.date
+    if start is None:
+        parser.error('a date or --start is required')
+    start=pd.Timestamp(start)
+    stop=pd.Timestamp(args.stop) if args.stop else start
     
-    # compress and encrypt the file in preparation for upload
-    subprocess.call(f'/usr/bin/gzip -c {ncfile} | /usr/bin/openssl enc -e -aes-256-cbc -salt -pass pass:ire15aus6 -out {ncfile}.gz.enc',shell=True)
+    client=set_scheduler(args.scheduler,args.dask_workers)
+    failed=run_params(start,stop,args.params,args.workers,args.pool,args.profile,args.force)
     
-    #openssl enc -aes-256-cbc -salt -pass pass:<passwd> -in file.txt -out file.enc
+    status=0
+    for param in args.params:
+        if len(failed[param]):
+            print(f'{param} dates not processed:',' '.join(f'{d:%Y%m%d}' for d in failed[param]))
+            status=1
+    sys.exit(status)
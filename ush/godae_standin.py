@@ -0,0 +1,208 @@
+#!/bin/env python
+"""
+Local stand-ins for the usgodae.org HTTP and FTP servers
+
+Notes
+    Both serve one local directory on 127.0.0.1 so godae_transfer.py can be
+    tested offline (godae_transfer.py --local DIR).
+        HTTP  -- GET with keep-alive, Range, If-Modified-Since and
+                 Last-Modified, enough for resumed and wget -N style pulls
+        FTP   -- anonymous login, passive mode, TYPE, SIZE, STOR and APPE,
+                 enough for resumed and verified pushes
+    With fail_rate > 0 that fraction of transfers is cut off half way, the
+    connection is dropped, to exercise retries and resumes.
+
+Usage
+    python godae_standin.py DIR [--fail-rate 0.2]
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import email.utils
+import socketserver
+import threading
+import argparse
+import random
+import socket
+import os
+
+#----------------------------------------------------------------
+def local_path(root,path):
+    """
+    the file under root of a request path, None if it leaves root
+    """
+    path=os.path.normpath(os.path.join(root,path.split('?')[0].lstrip('/')))
+    if path!=root and not path.startswith(root+os.sep):
+        return None
+    return path
+#----------------------------------------------------------------
+class HTTPHandler(BaseHTTPRequestHandler):
+    """
+    GET of static files, root and fail_rate are set on the server
+    """
+    protocol_version='HTTP/1.1'
+
+    def log_message(self,format,*args):
+        pass
+
+    def do_GET(self):
+        path=local_path(self.server.root,self.path)
+        if path is None or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size=os.path.getsize(path)
+        mtime=int(os.path.getmtime(path))
+        since=self.headers.get('If-Modified-Since')
+        if since and 'Range' not in self.headers:
+            since=email.utils.parsedate_to_datetime(since).timestamp()
+            if mtime<=since:
+                self.send_response(304)
+                self.send_header('Content-Length','0')
+                self.end_headers()
+                return
+        start=0
+        if self.headers.get('Range','').startswith('bytes='):
+            start=int(self.headers['Range'][6:].split('-')[0])
+            if start>=size:
+                self.send_response(416)
+                self.send_header('Content-Range',f'bytes */{size}')
+                self.send_header('Content-Length','0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range',f'bytes {start}-{size-1}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length',str(size-start))
+        self.send_header('Last-Modified',email.utils.formatdate(mtime,usegmt=True))
+        self.end_headers()
+        length=size-start
+        if random.random()<self.server.fail_rate:
+            length//=2
+            self.close_connection=True
+        with open(path,'rb') as f:
+            f.seek(start)
+            self.wfile.write(f.read(length))
+#----------------------------------------------------------------
+class FTPHandler(socketserver.StreamRequestHandler):
+    """
+    one FTP control connection, root and fail_rate are set on the server
+    """
+    def reply(self,line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.cwd='/'
+        self.pasv=None
+        self.reply('220 GODAE stand-in')
+        for line in self.rfile:
+            cmd,_,arg=line.decode().strip().partition(' ')
+            cmd=cmd.upper()
+            if cmd=='QUIT':
+                self.reply('221 Bye')
+                return
+            handler=getattr(self,f'ftp_{cmd.lower()}',None)
+            if handler is None:
+                self.reply(f'502 {cmd} not implemented')
+            elif handler(arg) is False:
+                return  # connection dropped
+
+    def path(self,arg):
+        return local_path(self.server.root,os.path.join(self.cwd,arg))
+
+    def ftp_user(self,arg):
+        self.reply('331 Any password')
+
+    def ftp_pass(self,arg):
+        self.reply('230 Logged in')
+
+    def ftp_type(self,arg):
+        self.reply('200 Type set')
+
+    def ftp_noop(self,arg):
+        self.reply('200 OK')
+
+    def ftp_pwd(self,arg):
+        self.reply(f'257 "{self.cwd}"')
+
+    def ftp_cwd(self,arg):
+        path=self.path(arg)
+        if path is None or not os.path.isdir(path):
+            self.reply('550 No such directory')
+            return
+        self.cwd=os.path.join(self.cwd,arg)
+        self.reply('250 OK')
+
+    def ftp_pasv(self,arg):
+        if self.pasv is not None:
+            self.pasv.close()
+        self.pasv=socket.socket()
+        self.pasv.bind(('127.0.0.1',0))
+        self.pasv.listen(1)
+        port=self.pasv.getsockname()[1]
+        self.reply(f'227 Entering Passive Mode (127,0,0,1,{port>>8},{port&255})')
+
+    def ftp_size(self,arg):
+        path=self.path(arg)
+        if path is None or not os.path.isfile(path):
+            self.reply('550 No such file')
+            return
+        self.reply(f'213 {os.path.getsize(path)}')
+
+    def ftp_stor(self,arg,mode='wb'):
+        path=self.path(arg)
+        if path is None or self.pasv is None:
+            self.reply('550 Cannot store')
+            return
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        self.reply('150 Ready')
+        conn,_=self.pasv.accept()
+        self.pasv.close()
+        self.pasv=None
+        fail=random.random()<self.server.fail_rate
+        with conn, open(path,mode) as f:
+            while True:
+                block=conn.recv(65536)
+                if not block:
+                    break
+                if fail:
+                    f.write(block[:len(block)//2])
+                    break
+                f.write(block)
+        if fail:
+            return False
+        self.reply('226 Transfer complete')
+
+    def ftp_appe(self,arg):
+        return self.ftp_stor(arg,'ab')
+#----------------------------------------------------------------
+class FTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads=True
+    allow_reuse_address=True
+#----------------------------------------------------------------
+def start_servers(root,fail_rate=0.0):
+    """
+    Serve root over HTTP and FTP on free localhost ports in background
+    threads.  Returns the two base URLs.
+    """
+    root=os.path.abspath(root)
+    servers=[ThreadingHTTPServer(('127.0.0.1',0),HTTPHandler),FTPServer(('127.0.0.1',0),FTPHandler)]
+    for server in servers:
+        server.root=root
+        server.fail_rate=fail_rate
+        server.daemon_threads=True
+        threading.Thread(target=server.serve_forever,daemon=True).start()
+    http_port=servers[0].server_address[1]
+    ftp_port=servers[1].server_address[1]
+    return f'http://127.0.0.1:{http_port}',f'ftp://127.0.0.1:{ftp_port}'
+#----------------------------------------------------------------
+
+# main routine starts here
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a directory over local HTTP and FTP')
+    parser.add_argument('root',type=str,help='directory to serve')
+    parser.add_argument('--fail-rate',type=float,default=0.0,help='fraction of transfers cut off')
+    args = parser.parse_args()
+
+    http_url,ftp_url=start_servers(args.root,args.fail_rate)
+    print('serving',args.root,'at',http_url,'and',ftp_url)
+    threading.Event().wait()
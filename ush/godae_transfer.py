@@ -0,0 +1,288 @@
+#!/bin/env python
+"""
+Concurrent, retrying GODAE class4 transfers
+
+Notes
+    get  -- the FOAM and GIOPS class4 .nc.gz.enc files of every date from
+            usgodae.org over https into {godaeDir}/incoming
+    put  -- the HYCOM RTOFS .nc.gz.enc products of every date from
+            {godaeDir}/outgoing to ftp.usgodae.org/pub/incoming/class4
+    All files of the date range go through one pool of --workers threads.
+    Each thread keeps its connection to a host open and reuses it for its
+    next file.
+
+    Downloads go to a .part file and resume with a Range request after a
+    dropped connection.  The size must match Content-Length when the server
+    sends one, and the file must decrypt and gunzip (the gzip CRC) before
+    it is renamed into place.
+    A file already downloaded is only fetched again when the server has a
+    newer copy, as wget -N.
+    Products are checked the same way before they are pushed.  Uploads
+    resume with APPE from the size the server already has, and the server
+    SIZE must match afterwards when the server reports it.
+    A failed transfer is retried with exponential backoff.  A file that
+    still fails is reported and the others carry on.
+
+    --local DIR runs against the stand-in HTTP and FTP servers of
+    godae_standin.py serving DIR instead, files are pulled from
+    DIR/YYYY/YYYYMMDD and pushed to DIR/incoming.  --fail-rate cuts off
+    that fraction of transfers half way to test the recovery.
+
+Usage
+    python godae_transfer.py get 20230110 [20230116]
+    python godae_transfer.py put 20230110 [20230116] --workers 4
+"""
+import warnings
+warnings.filterwarnings("ignore")
+import pandas as pd
+from datetime import datetime
+import concurrent.futures
+import urllib.parse
+import email.utils
+import http.client
+import threading
+import argparse
+import ftplib
+import time
+import os, sys
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+import godae_rtofsv2 as godae
+
+godae_url='https://usgodae.org/pub/outgoing/GODAE_class4'
+godae_ftp='ftp://ftp.usgodae.org/pub/incoming/class4'
+params=['profile','aice','SST','SLA']
+timeout=120
+blocksize=1024*1024
+
+_connections=threading.local()  # per thread: (scheme, host) -> open connection
+
+#----------------------------------------------------------------
+def connection(url):
+    """
+    the calling thread's open connection to the host of url, FTP logged in
+    """
+    parts=urllib.parse.urlsplit(url)
+    pool=_connections.__dict__.setdefault('pool',{})
+    key=(parts.scheme,parts.netloc)
+    if key not in pool:
+        if parts.scheme=='ftp':
+            ftp=ftplib.FTP(timeout=timeout)
+            ftp.connect(parts.hostname,parts.port or 21)
+            ftp.login(parts.username or 'anonymous',parts.password or 'anonymous@')
+            pool[key]=ftp
+        elif parts.scheme=='https':
+            pool[key]=http.client.HTTPSConnection(parts.netloc,timeout=timeout)
+        else:
+            pool[key]=http.client.HTTPConnection(parts.netloc,timeout=timeout)
+    return pool[key]
+#----------------------------------------------------------------
+def drop_connection(url):
+    """
+    close the calling thread's connection to the host of url after an error
+    """
+    parts=urllib.parse.urlsplit(url)
+    conn=_connections.__dict__.get('pool',{}).pop((parts.scheme,parts.netloc),None)
+    if conn is not None:
+        conn.close()
+#----------------------------------------------------------------
+def check_class4(fname,digest):
+    """
+    decrypt and gunzip a .nc.gz.enc file, OSError if it is damaged
+    """
+    godae.gunzip(godae.decrypt_blocks(fname,digest=digest))
+#----------------------------------------------------------------
+def download(url,dest,digest):
+    """
+    Fetch url to dest, resuming a partial download.  Returns the number of
+    bytes fetched, 0 when dest is already current.
+    """
+    part=f'{dest}.part'
+    offset=os.path.getsize(part) if os.path.exists(part) else 0
+    headers={}
+    if offset:
+        headers['Range']=f'bytes={offset}-'
+    elif os.path.exists(dest):
+        headers['If-Modified-Since']=email.utils.formatdate(os.path.getmtime(dest),usegmt=True)
+    conn=connection(url)
+    try:
+        conn.request('GET',urllib.parse.urlsplit(url).path,headers=headers)
+        resp=conn.getresponse()
+        if resp.status in (304,404,416):
+            resp.read()
+        if resp.status==304:
+            return 0
+        if resp.status==404:
+            raise FileNotFoundError(f'{url} not found')
+        if resp.status==416:  # the partial file is no good, start over
+            os.remove(part)
+            raise OSError(f'{url} range not satisfiable, restarting')
+        if resp.status==200:
+            offset=0
+        elif resp.status!=206:
+            resp.read()
+            raise OSError(f'{url} HTTP {resp.status} {resp.reason}')
+        length=resp.getheader('Content-Length')
+        if length is None:  # chunked, the size is only checked by decrypting
+            expected=None
+        else:
+            expected=offset+int(length)
+        modified=resp.getheader('Last-Modified')
+        with open(part,'ab' if offset else 'wb') as f:
+            for block in iter(lambda: resp.read(blocksize),b''):
+                f.write(block)
+    except (OSError,http.client.HTTPException):
+        drop_connection(url)
+        raise
+    size=os.path.getsize(part)
+    if expected is not None and size!=expected:  # the server hung up part way
+        drop_connection(url)
+        raise OSError(f'{url} {size} of {expected} bytes')
+    try:
+        check_class4(part,digest)
+    except OSError:
+        os.remove(part)
+        raise
+    os.replace(part,dest)
+    if modified:
+        mtime=email.utils.parsedate_to_datetime(modified).timestamp()
+        os.utime(dest,(mtime,mtime))
+    return size-offset
+#----------------------------------------------------------------
+def remote_size(ftp,path):
+    """
+    size of a file on the FTP server, None if it has none or does not say
+    """
+    try:
+        return ftp.size(path)
+    except ftplib.error_perm:
+        return None
+#----------------------------------------------------------------
+def upload(src,url,digest):
+    """
+    Push src into the FTP directory url, resuming a partial upload.
+    Returns the number of bytes sent.
+    """
+    check_class4(src,digest)
+    path=urllib.parse.urlsplit(url).path.rstrip('/')+'/'+os.path.basename(src)
+    size=os.path.getsize(src)
+    ftp=connection(url)
+    try:
+        ftp.voidcmd('TYPE I')
+        offset=remote_size(ftp,path) or 0
+        if offset>size:
+            offset=0
+        if offset<size:
+            with open(src,'rb') as f:
+                f.seek(offset)
+                ftp.storbinary(f'{"APPE" if offset else "STOR"} {path}',f,blocksize)
+        sent=remote_size(ftp,path)
+    except ftplib.error_perm:
+        raise
+    except (OSError,EOFError,ftplib.Error):
+        drop_connection(url)
+        raise
+    if sent is not None and sent!=size:
+        raise OSError(f'{path} {sent} of {size} bytes on the server')
+    return size-offset
+#----------------------------------------------------------------
+def retry(func,name,*args,retries=4,backoff=2.0):
+    """
+    Call func until it succeeds, waiting backoff, 2*backoff, ... seconds
+    between the retries.  Missing files and refused commands are not
+    retried.
+    """
+    for attempt in range(retries+1):
+        try:
+            return func(*args)
+        except (FileNotFoundError,ftplib.error_perm):
+            raise
+        except (OSError,EOFError,http.client.HTTPException,ftplib.Error) as e:
+            if attempt==retries:
+                raise
+            print(f'retry {attempt+1}/{retries} {name}: {str(e) or type(e).__name__}')
+            time.sleep(backoff*2**attempt)
+#----------------------------------------------------------------
+def get_jobs(dates):
+    """
+    (function, name, args) of the downloads of every date
+    """
+    jobs=[]
+    for theDate in dates:
+        for param in params:
+            fname=godae.godae_filename(theDate,param)+'.gz.enc'
+            url=f'{godae_url}/{theDate:%Y}/{theDate:%Y%m%d}/{fname}'
+            dest=f'{godae.godaeDir}/incoming/{fname}'
+            jobs.append((download,fname,(url,dest,godae.class4_digest(theDate,param))))
+    return jobs
+#----------------------------------------------------------------
+def put_jobs(dates):
+    """
+    (function, name, args) of the uploads of every product that exists
+    """
+    jobs=[]
+    for theDate in dates:
+        for param in params:
+            src=godae.product_file(theDate,param)+'.gz.enc'
+            if os.path.exists(src):
+                jobs.append((upload,os.path.basename(src),(src,godae_ftp,godae.godae_digest)))
+    return jobs
+#----------------------------------------------------------------
+def transfer(jobs,workers=4,retries=4,backoff=2.0):
+    """
+    Run the transfers in a pool of workers.  Returns the number of files
+    that failed.
+    """
+    start=time.perf_counter()
+    moved=0
+    failed=0
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures={executor.submit(retry,func,name,*args,retries=retries,backoff=backoff):name
+                 for func,name,args in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            name=futures[future]
+            try:
+                nbytes=future.result()
+            except Exception as e:
+                print('FAILED',name,e)
+                failed+=1
+                continue
+            moved+=nbytes
+            print(name,f'{nbytes} bytes' if nbytes else 'up to date')
+    seconds=time.perf_counter()-start
+    print(f'{len(jobs)-failed} of {len(jobs)} files, {moved/1e6:.1f} MB in {seconds:.1f}s,',
+          f'{moved/1e6/max(seconds,1e-6):.1f} MB/s')
+    return failed
+#----------------------------------------------------------------
+
+# main routine starts here
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download the GODAE class4 files or upload the products')
+    parser.add_argument('direction',choices=['get','put'])
+    parser.add_argument('start',type=str,help='first date YYYYMMDD')
+    parser.add_argument('stop',type=str,nargs='?',help='last date YYYYMMDD (default: start)')
+    parser.add_argument('--workers',type=int,default=4,help='concurrent transfers')
+    parser.add_argument('--retries',type=int,default=4,help='retries of a failed transfer')
+    parser.add_argument('--backoff',type=float,default=2.0,help='seconds before the first retry, doubled each time')
+    parser.add_argument('--godae-dir',type=str,default=None,help='local GODAE dir with incoming/ and outgoing/')
+    parser.add_argument('--local',type=str,default=None,help='use stand-in servers serving this dir')
+    parser.add_argument('--fail-rate',type=float,default=0.0,help='fraction of stand-in transfers cut off')
+    args = parser.parse_args()
+
+    if args.godae_dir:
+        godae.godaeDir=args.godae_dir
+    if args.local:
+        import godae_standin
+        http_url,ftp_url=godae_standin.start_servers(args.local,args.fail_rate)
+        godae_url=http_url
+        godae_ftp=f'{ftp_url}/incoming'
+        os.makedirs(f'{args.local}/incoming',exist_ok=True)
+    os.makedirs(f'{godae.godaeDir}/incoming',exist_ok=True)
+
+    start=datetime.strptime(args.start,'%Y%m%d')
+    stop=datetime.strptime(args.stop,'%Y%m%d') if args.stop else start
+    dates=pd.date_range(start,stop)
+    jobs=get_jobs(dates) if args.direction=='get' else put_jobs(dates)
+    failed=transfer(jobs,args.workers,args.retries,args.backoff)
+    sys.exit(1 if failed else 0)
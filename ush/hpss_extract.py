@@ -0,0 +1,215 @@
+#!/bin/env python
+"""
+Extract one day of Global RTOFS output from HPSS and recompress it
+
+Notes
+    Replaces the loops of hpss_extractor.sh.  The day's tar file is found
+    and indexed once (hpsstar dir, hpsstar inx), then every wanted member
+    goes through two bounded pools:
+        extract   -- hpsstar getnostage into the scratch dir, 1hrly/3hrly
+                     renamed to daily (--hpss-workers, default 2)
+        compress  -- nccopy -7 -d 4 into the output dir (--workers, default 4)
+    A member is handed to the compress pool as soon as it is extracted, so
+    the two overlap while neither oversubscribes the node nor HPSS.
+
+    Progress is kept per file in extract_state.json in the scratch dir, a
+    member is 'extracted' or 'done'.  Outputs are written under a temporary
+    name and renamed, so a rerun after a failure or a timeout only redoes
+    the files that are not finished.  The scratch dir is removed once the
+    whole day is done.  Files already in the archive are skipped.
+
+    To test without HPSS, --hpsstar 'python hpsstar_local.py' serves a local
+    tar file the same way.
+
+Usage
+    python hpss_extract.py 20230110 --workdir /scratch2/NCEPDEV/stmp1/Deanna.Spindler
+"""
+from datetime import datetime
+import concurrent.futures
+import subprocess
+import threading
+import argparse
+import shutil
+import shlex
+import json
+import os, sys
+
+hpsstar='/scratch2/NCEPDEV/ocean/Deanna.Spindler/save/VPPPG/Global_RTOFS/EMC_ocean-prod-gen/dataproc/scripts/hpsstar'
+nccopy=['nccopy','-7','-d','4']
+hpss_template='/NCEPPROD/1year/hpssprod/runhistory/rh{:%Y}/{:%Y%m}/{:%Y%m%d}'
+
+fcsts=['n048','n024','f024','f048','f072','f096','f120','f144','f168','f192']
+params=['3ztio','3zsio','3zuio','3zvio','diag','prog','ice']
+
+#----------------------------------------------------------------
+def run(cmd,cwd=None):
+    """
+    run a command, its stdout as text
+    """
+    return subprocess.run(cmd,cwd=cwd,check=True,capture_output=True,text=True).stdout
+#----------------------------------------------------------------
+def find_tar(hpssDir):
+    """
+    the RTOFS netcdf tar file of one HPSS day directory
+    """
+    for line in run(shlex.split(hpsstar)+['dir',hpssDir]).splitlines():
+        fields=line.split()
+        if len(fields)<9:
+            continue
+        name=fields[8]
+        if 'rtofs' in name and 'idx' not in name and 'nc' in name:
+            return f'{hpssDir}/{name}'
+    raise FileNotFoundError(f'no RTOFS tar file in {hpssDir}')
+#----------------------------------------------------------------
+def tar_members(tarFile):
+    """
+    The wanted members of the tar file, from a single index listing, in
+    the order of fcsts and params
+    """
+    index=run(shlex.split(hpsstar)+['inx',tarFile]).split()
+    members=[]
+    for fcst in fcsts:
+        for param in params:
+            members+=[m for m in index if param in m and fcst in m and m not in members]
+    return members
+#----------------------------------------------------------------
+def daily_name(member):
+    """
+    the name of a member once extracted
+    """
+    return os.path.basename(member).replace('1hrly','daily').replace('3hrly','daily')
+#----------------------------------------------------------------
+def load_state(stateFile):
+    """
+    per-file progress of an earlier run, member -> 'extracted' or 'done'
+    """
+    if not os.path.exists(stateFile):
+        return {}
+    with open(stateFile) as f:
+        return json.load(f)
+#----------------------------------------------------------------
+def save_state(stateFile,state,lock):
+    """
+    write the progress, replacing the file in one step
+    """
+    with lock:
+        with open(stateFile+'.tmp','w') as f:
+            json.dump(state,f,indent=1,sort_keys=True)
+        os.replace(stateFile+'.tmp',stateFile)
+#----------------------------------------------------------------
+def extract(tarFile,member,ncDir):
+    """
+    pull one member out of the tar file, returns the extracted file
+    """
+    run(shlex.split(hpsstar)+['getnostage',tarFile,member],cwd=ncDir)
+    extracted=os.path.join(ncDir,daily_name(member))
+    os.replace(os.path.join(ncDir,member),extracted)
+    return extracted
+#----------------------------------------------------------------
+def compress(extracted,outDir):
+    """
+    nc-3 to nc-4 classic with deflation, returns the output file
+    """
+    fname=os.path.basename(extracted)
+    tmp=os.path.join(outDir,fname+'.part')
+    try:
+        run(nccopy+[extracted,tmp])
+    except (OSError,subprocess.CalledProcessError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp,os.path.join(outDir,fname))
+    os.remove(extracted)
+    return os.path.join(outDir,fname)
+#----------------------------------------------------------------
+def extract_day(theDate,workDir,archDir=None,hpssDir=None,workers=4,hpss_workers=2):
+    """
+    Extract and recompress the RTOFS files of one day into
+    {workDir}/cdo/YYYYMMDD.  Returns the number of files that failed.
+    """
+    ncDir=f'{workDir}/hpss/{theDate:%Y%m%d}'
+    outDir=f'{workDir}/cdo/{theDate:%Y%m%d}'
+    if hpssDir is None:
+        hpssDir=hpss_template.format(theDate,theDate,theDate)
+    os.makedirs(ncDir,exist_ok=True)
+    os.makedirs(outDir,exist_ok=True)
+
+    stateFile=f'{ncDir}/extract_state.json'
+    state=load_state(stateFile)
+    lock=threading.Lock()
+
+    tarFile=find_tar(hpssDir)
+    members=tar_members(tarFile)
+    print(f'{tarFile}: {len(members)} files')
+
+    failed=0
+    with concurrent.futures.ThreadPoolExecutor(hpss_workers) as hpss_pool, \
+         concurrent.futures.ThreadPoolExecutor(workers) as cpu_pool:
+
+        def compressed(member,extracted):
+            compress(extracted,outDir)
+            with lock:
+                state[member]='done'
+            save_state(stateFile,state,lock)
+            print('done',os.path.basename(extracted))
+
+        def extracted(member):
+            fname=extract(tarFile,member,ncDir)
+            with lock:
+                state[member]='extracted'
+            save_state(stateFile,state,lock)
+            return cpu_pool.submit(compressed,member,fname)
+
+        jobs={}
+        for member in members:
+            fname=daily_name(member)
+            if archDir and os.path.exists(f'{archDir}/{fname}'):
+                continue
+            # outputs only appear once complete
+            if os.path.exists(f'{outDir}/{fname}'):
+                continue
+            if state.get(member)=='extracted' and os.path.exists(f'{ncDir}/{fname}'):
+                jobs[cpu_pool.submit(compressed,member,f'{ncDir}/{fname}')]=member
+            else:
+                jobs[hpss_pool.submit(extracted,member)]=member
+
+        # extraction futures resolve to their compression future
+        while jobs:
+            done,_=concurrent.futures.wait(jobs,return_when=concurrent.futures.FIRST_COMPLETED)
+            for job in done:
+                member=jobs.pop(job)
+                try:
+                    result=job.result()
+                except Exception as e:
+                    print('FAILED',member,e,getattr(e,'stderr',''))
+                    failed+=1
+                    continue
+                if isinstance(result,concurrent.futures.Future):
+                    jobs[result]=member
+
+    if failed==0:
+        shutil.rmtree(ncDir,ignore_errors=True)
+    return failed
+#----------------------------------------------------------------
+
+# main routine starts here
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract and recompress one day of Global RTOFS from HPSS')
+    parser.add_argument('date',type=str,help='YYYYMMDD')
+    parser.add_argument('--workdir',type=str,default='/scratch2/NCEPDEV/stmp1/Deanna.Spindler',
+                        help='scratch dir, files go to WORKDIR/cdo/YYYYMMDD')
+    parser.add_argument('--archdir',type=str,default=None,
+                        help='archive dir of the day, files already there are skipped')
+    parser.add_argument('--hpss',type=str,default=None,help='HPSS day directory (default: runhistory)')
+    parser.add_argument('--hpsstar',type=str,default=hpsstar,help='hpsstar command, may include arguments')
+    parser.add_argument('--workers',type=int,default=4,help='concurrent nccopy jobs')
+    parser.add_argument('--hpss-workers',type=int,default=2,help='concurrent hpsstar extractions')
+    args = parser.parse_args()
+
+    hpsstar=args.hpsstar
+    theDate=datetime.strptime(args.date,'%Y%m%d')
+    print('Starting:',datetime.now())
+    failed=extract_day(theDate,args.workdir,args.archdir,args.hpss,args.workers,args.hpss_workers)
+    print('Finished:',datetime.now())
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,62 @@
+#!/bin/env python
+"""
+Local stand-in for hpsstar, serves tar files from the local file system
+
+Notes
+    Implements the three calls hpss_extract.py makes, with HPSS paths read
+    as local paths:
+        dir DIR                -- ls -l style listing, name in field 9
+        inx TARFILE            -- member names, one per line
+        getnostage TARFILE MEMBER
+                               -- extract the member into the current dir
+
+Usage
+    python hpss_extract.py 20230110 --hpss /tmp/hpss/20230110 --hpsstar 'python hpsstar_local.py'
+"""
+from datetime import datetime
+import tarfile
+import os, sys
+
+#----------------------------------------------------------------
+def list_dir(path):
+    """
+    ls -l style listing of a directory
+    """
+    for name in sorted(os.listdir(path)):
+        st=os.stat(os.path.join(path,name))
+        mtime=datetime.fromtimestamp(st.st_mtime)
+        print(f'-rw-r--r-- 1 hpss hpss {st.st_size} {mtime:%b %d %H:%M} {name}')
+#----------------------------------------------------------------
+def index(tarFile):
+    """
+    member names of a tar file
+    """
+    with tarfile.open(tarFile) as tar:
+        for member in tar.getmembers():
+            if member.isfile():
+                print(member.name)
+#----------------------------------------------------------------
+def get(tarFile,member):
+    """
+    extract one member into the current dir
+    """
+    with tarfile.open(tarFile) as tar:
+        tar.extract(member,'.',filter='data')
+#----------------------------------------------------------------
+
+# main routine starts here
+
+if __name__ == '__main__':
+    if len(sys.argv)<3:
+        print('usage: hpsstar_local.py dir DIR | inx TARFILE | getnostage TARFILE MEMBER')
+        sys.exit(2)
+    cmd=sys.argv[1]
+    if cmd=='dir':
+        list_dir(sys.argv[2])
+    elif cmd=='inx':
+        index(sys.argv[2])
+    elif cmd=='getnostage' and len(sys.argv)==4:
+        get(sys.argv[2],sys.argv[3])
+    else:
+        print('unknown command',' '.join(sys.argv[1:]))
+        sys.exit(2)
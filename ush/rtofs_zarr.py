@@ -0,0 +1,123 @@
+#!/bin/env python
+"""
+Mirror the daily Global RTOFS archive into chunked zarr stores
+
+Notes
+    One store per run day and file type next to the NetCDF files,
+        {modelDir}/YYYYMMDD/rtofs_glo_{3dz|2ds}_{filetype}.zarr
+    with the variables godae_rtofsv2.py reads for every lead (n024, f024 to
+    f192) stacked along a 'lead' dimension, MT becomes a coordinate on lead.
+    Chunks are one lead, all depths and rtofsTile x rtofsTile in Y and X, so
+    the obs columns only touch the tiles around them.
+
+    The stores are append-only: leads already in a store are skipped and new
+    leads are appended as they reach the archive, so this can be rerun for a
+    day at any time.  A lead is added to {store}.leads only once its append
+    has finished, and godae_rtofsv2.py only reads the leads listed there,
+    so a GODAE job can run while a day is being mirrored.  A store with
+    leads that are not listed was interrupted and is written again.
+    godae.sh mirrors the run days of each job before it processes them.
+
+    godae_rtofsv2.py reads a lead from the store when it has it and from the
+    NetCDF file otherwise, the NetCDF archive is left as it is.
+
+Usage
+    python rtofs_zarr.py 20230110 [20230116]
+"""
+import warnings
+warnings.filterwarnings("ignore")
+import pandas as pd
+import xarray as xr
+from datetime import datetime
+import argparse
+import shutil
+import os, sys
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+import godae_rtofsv2 as godae
+
+#----------------------------------------------------------------
+def archive_leads():
+    """
+    (ftype, fcst_hrs) of the leads archived for every run day
+    """
+    return [('n',24)]+[('f',fcst) for fcst in godae.rtofs_fcsts[1:]]
+#----------------------------------------------------------------
+def zarr_leads(store):
+    """
+    leads in a store, complete or not, None if it cannot be opened
+    """
+    if not os.path.exists(store):
+        return []
+    try:
+        return list(xr.open_zarr(store).lead.values)
+    except (OSError,KeyError,ValueError):  # the first write did not finish
+        return None
+#----------------------------------------------------------------
+def write_leads(store,leads):
+    """
+    list the complete leads of a store, replacing the list in one step
+    """
+    with open(f'{store}.leads.tmp','w') as f:
+        f.write('\n'.join(leads)+'\n')
+    os.replace(f'{store}.leads.tmp',f'{store}.leads')
+#----------------------------------------------------------------
+def lead_dataset(fname,filetype,lead):
+    """
+    The variables of one RTOFS file with a lead dimension, chunked and with
+    the NetCDF encodings dropped for the zarr store.
+    """
+    ds=xr.open_dataset(fname,decode_times=True)
+    ds=ds[godae.rtofs_vars[filetype]].squeeze('MT').expand_dims(lead=[lead])
+    ds.coords['MT']=(('lead',),[ds.MT.values])
+    for var in ds.variables.values():
+        var.encoding={}
+    return ds.chunk({'lead':1,'Y':godae.rtofsTile,'X':godae.rtofsTile})
+#----------------------------------------------------------------
+def mirror_day(runDate):
+    """
+    append the archived leads of one run day that are not in its stores yet
+    """
+    count=0
+    for filetype in godae.rtofs_dims:
+        store=godae.rtofs_zarr(runDate,filetype)
+        have=godae.rtofs_zarr_leads(store)
+        if zarr_leads(store)!=have:  # an append that did not finish
+            print('rewriting',store)
+            have=[]
+            write_leads(store,have)
+            shutil.rmtree(store,ignore_errors=True)
+        for ftype,fcst_hrs in archive_leads():
+            lead=f'{ftype}{fcst_hrs:03n}'
+            fname=godae.rtofs_file(runDate,ftype,fcst_hrs,filetype)
+            if lead in have or not os.path.exists(fname):
+                continue
+            ds=lead_dataset(fname,filetype,lead)
+            if len(have):
+                ds.to_zarr(store,mode='a',append_dim='lead')
+            else:
+                ds.to_zarr(store,mode='w-')
+            ds.close()
+            have.append(lead)
+            write_leads(store,have)
+            count+=1
+            print('mirrored',fname)
+    return count
+#----------------------------------------------------------------
+
+# main routine starts here
+
+if __name__ == '__main__':
+    if godae.zarr is None:
+        print('zarr is not installed')
+        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Mirror the RTOFS archive into zarr stores')
+    parser.add_argument('start',type=str,help='first run date YYYYMMDD')
+    parser.add_argument('stop',type=str,nargs='?',help='last run date YYYYMMDD (default: start)')
+    args = parser.parse_args()
+
+    start=datetime.strptime(args.start,'%Y%m%d')
+    stop=datetime.strptime(args.stop,'%Y%m%d') if args.stop else start
+    for runDate in pd.date_range(start,stop):
+        count=mirror_day(runDate)
+        print(f'{runDate:%Y%m%d}: {count} leads mirrored')